@@ -0,0 +1,51 @@
+import zlib
+from collections import defaultdict
+
+# Near-duplicate detection for chunk dedup at index time (Retriever(..., dedup=<Jaccard threshold>)):
+# MinHash signatures over word shingles, and a banded LSH table over them.
+MINHASH_PERMS = 128
+
+_MINHASH_PARAMS = {}
+
+def minhash(tokens, perms=MINHASH_PERMS, seed=0):
+    # MinHash signature over the word 3-shingles of `tokens` (multiply-shift hashes of a CRC32), as bytes of
+    # uint32s
+    import numpy as np
+    if (perms, seed) not in _MINHASH_PARAMS:
+        rng = np.random.default_rng(seed)
+        _MINHASH_PARAMS[perms, seed] = (rng.integers(1, 2**63, perms, dtype=np.uint64) | np.uint64(1),
+                                        rng.integers(0, 2**63, perms, dtype=np.uint64))
+    a, b = _MINHASH_PARAMS[perms, seed]
+    shingles = {" ".join(tokens[j:j+3]) for j in range(max(1, len(tokens)-2))}
+    x = np.fromiter((zlib.crc32(sh.encode()) for sh in shingles), np.uint64, len(shingles))
+    return ((a[:, None]*x[None] + b[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32).tobytes()
+
+class MinHashLSH:
+    # near-duplicate lookup over MinHash signatures, banded so a new signature is only compared with those
+    # sharing a band. Rows per band are the most that still put the banding's S-curve midpoint,
+    # (1/bands)^(1/rows), at or below `threshold`; candidates are then kept on their estimated Jaccard
+    def __init__(self, threshold=0.8, perms=MINHASH_PERMS):
+        if not 0<threshold<=1: raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        self.threshold, self.perms = threshold, perms
+        self.rows = max(r for r in range(1, perms+1) if perms%r==0 and (r/perms)**(1/r)<=threshold) if threshold<1 else perms
+        self._tables = [defaultdict(list) for _ in range(perms//self.rows)]; self.sigs = {}
+    def _bands(self, sig):
+        w = 4*self.rows
+        return zip(self._tables, (sig[j:j+w] for j in range(0, len(sig), w)))
+    def add(self, key, sig):
+        self.sigs[key] = sig
+        for table,band in self._bands(sig): table[band].append(key)
+    def remove(self, key):
+        sig = self.sigs.pop(key)
+        for table,band in self._bands(sig):
+            table[band].remove(key)
+            if not table[band]: del table[band]
+    def query(self, sig):
+        # the most similar stored key at or above the threshold (lowest key on ties), else None
+        import numpy as np
+        cands = sorted({k for table,band in self._bands(sig) for k in table.get(band, ())})
+        if not cands: return None
+        q = np.frombuffer(sig, np.uint32)
+        sims = [(np.frombuffer(self.sigs[k], np.uint32)==q).mean() for k in cands]
+        j = int(np.argmax(sims))
+        return cands[j] if sims[j]>=self.threshold else None
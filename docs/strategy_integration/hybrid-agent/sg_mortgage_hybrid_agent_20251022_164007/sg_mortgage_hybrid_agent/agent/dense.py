@@ -0,0 +1,85 @@
+import math
+import numpy as np
+from agent.retrieval import CHUNK_SIZE, iter_kb, _tokenize
+
+# Offline dense retrieval: feature-hashed character n-gram embeddings (no model, no network) indexed with
+# an inverted file (IVF): spherical k-means splits the KB into `lists`, and a query scans only the `probe`
+# lists whose centroids are nearest. Char n-grams tie together spelling/morphology variants ("lock-in" /
+# "lock in", "refinance" / "refinancing") that exact token overlap misses. (Random-hyperplane LSH was tried
+# first: these embeddings sit so close together that buckets selective enough to be sub-linear missed half
+# the exact top-k, and buckets wide enough for good recall held most of the KB.)
+
+_FNV = np.uint32(16777619)
+
+def embed(texts, dim=256, ngrams=(3,4,5), seed=0):
+    out = np.zeros((len(texts), dim), np.float32)
+    salt = np.uint32((seed*2654435761) & 0xFFFFFFFF)
+    for r,text in enumerate(texts):
+        b = np.frombuffer((" "+" ".join(_tokenize(text))+" ").encode(), np.uint8).astype(np.uint32)
+        for n in ngrams:
+            m = len(b)-n+1
+            if m<=0: continue
+            h = np.full(m, 2166136261, np.uint32) ^ salt
+            for j in range(n): h = (h ^ b[j:j+m]) * _FNV
+            # low bits pick the bucket, the top bit a sign so colliding n-grams tend to cancel
+            out[r] += np.bincount(h % dim, weights=1.0-2.0*(h>>31), minlength=dim)
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out/np.where(norms==0, 1, norms)
+
+def _assign(x, centroids, block=8192):
+    # nearest centroid by inner product, in blocks so the (rows x lists) score matrix stays small
+    return np.concatenate([np.argmax(x[i:i+block] @ centroids.T, axis=1) for i in range(0, len(x), block)]
+                          or [np.zeros(0, np.int64)])
+
+def _kmeans(x, c, iters, rng):
+    # spherical k-means: unit-length centroids; a list that empties keeps its previous centroid
+    centroids = x[rng.choice(len(x), c, replace=False)].copy()
+    for _ in range(iters):
+        a = _assign(x, centroids); order = np.argsort(a, kind="stable")
+        counts = np.bincount(a, minlength=c); full = counts>0
+        sums = np.add.reduceat(x[order], (np.cumsum(counts)-counts)[full])
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[full] = sums/np.where(norms==0, 1, norms)
+    return centroids
+
+class DenseRetriever:
+    def __init__(self, kb_dir, dim=256, ngrams=(3,4,5), lists=None, probe=32, iters=10, seed=0,
+                 chunk_size=CHUNK_SIZE, overlap=0):
+        self.docs = list(iter_kb(kb_dir, chunk_size, overlap))
+        self.dim, self.ngrams, self.seed = dim, ngrams, seed
+        mat = embed([d["text"] for d in self.docs], dim, ngrams, seed); n = len(mat)
+        # default: ~8 sqrt(n) lists of ~sqrt(n)/8 chunks, so 32 probes scan ~1.3% of 100k chunks; below
+        # 4096 chunks one list (an exact scan) is as fast as probing
+        lists = max(1, min(n, lists or (int(8*math.sqrt(n)) if n>=4096 else 1)))
+        self.probe = probe
+        rng = np.random.default_rng(seed)
+        # trained on a sample: 32 chunks per list is plenty to place the centroids
+        sample = mat[rng.choice(n, min(n, 32*lists), replace=False)] if n else mat
+        self.centroids = _kmeans(sample, lists, iters, rng) if n else np.zeros((1, dim), np.float32)
+        a = _assign(mat, self.centroids)
+        # rows stored list by list, so a list is one contiguous slice; ids maps a row back to its chunk
+        self.ids = np.argsort(a, kind="stable")
+        self.mat = mat[self.ids]
+        self.bounds = np.searchsorted(a[self.ids], np.arange(len(self.centroids)+1))
+    def _probe(self, q):
+        # the row ranges of the `probe` lists whose centroids are nearest the query
+        p = min(self.probe, len(self.centroids))
+        near = np.argpartition(-(self.centroids @ q), p-1)[:p]
+        return [(self.bounds[l], self.bounds[l+1]) for l in near.tolist()]
+    def _rank(self, q, ranges, k):
+        ranges = [(a,b) for a,b in ranges if b>a]
+        if not ranges: return []
+        # a mat-vec per contiguous list: no gather of candidate rows
+        scores = np.concatenate([self.mat[a:b] @ q for a,b in ranges])
+        cand = self.ids[np.concatenate([np.arange(a, b) for a,b in ranges])]
+        kk = min(k, len(cand))
+        top = np.argpartition(-scores, kk-1)[:kk]
+        top = top[np.lexsort((cand[top], -scores[top]))]
+        return [ {**self.docs[i], "score":float(s)} for i,s in zip(cand[top].tolist(), scores[top].tolist()) ]
+    def search(self, query, k=4):
+        q = embed([query], self.dim, self.ngrams, self.seed)[0]
+        return self._rank(q, self._probe(q), k)
+    def search_exact(self, query, k=4):
+        # brute-force scan over every chunk; the reference the IVF path is measured against
+        q = embed([query], self.dim, self.ngrams, self.seed)[0]
+        return self._rank(q, [(0, len(self.docs))], k)
@@ -0,0 +1,103 @@
+import threading, zlib
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# Chunk storage for the in-memory index: compressed chunk text, per-chunk metadata records, and the hits
+# search returns over them.
+META_FIELDS = ("source","section","date","bank")
+
+class Chunk(Mapping):
+    # one chunk's metadata; the text stays in the DocStore buffer until asked for. Reads like the dict
+    # iter_chunks yields ({"id","text",*META_FIELDS})
+    __slots__ = ("_store", "_i", "id", "source", "section", "date", "bank", "aliases")
+    _KEYS = ("id", "text") + META_FIELDS + ("aliases",)
+    @property
+    def text(self): return self._store.text(self._i)
+    def __getitem__(self, key):
+        if key not in self._KEYS: raise KeyError(key)
+        return getattr(self, key)
+    def __iter__(self): return iter(self._KEYS)
+    def __len__(self): return len(self._KEYS)
+    def __repr__(self): return f"Chunk({dict(self)!r})"
+
+class Hit(Mapping):
+    # a search result: a chunk plus its score, with the text decoded only when read (or replaced by a
+    # query-focused snippet). Pickles (e.g. across a shard pipe) as a plain dict
+    __slots__ = ("chunk", "score", "snippet")
+    def __init__(self, chunk, score, snippet=None): self.chunk = chunk; self.score = score; self.snippet = snippet
+    def __getitem__(self, key):
+        if key=="score": return self.score
+        if key=="text" and self.snippet is not None: return self.snippet
+        return self.chunk[key]
+    def __iter__(self): yield from self.chunk; yield "score"
+    def __len__(self): return len(self.chunk)+1
+    def __reduce__(self): return (dict, (dict(self),))
+    def __repr__(self): return f"Hit({dict(self)!r})"
+
+TEXT_BLOCK = 1<<14  # bytes of chunk text per compressed block
+TEXT_CACHE = 64  # decompressed blocks kept in the LRU
+
+class DocStore:
+    # chunk texts in zlib blocks of consecutive chunks from one source file, up to `block` bytes of text
+    # each (0: blocks stay uncompressed), metadata in Chunk records whose repeated values (source, section,
+    # date, bank) share one string object. A block is decompressed only when one of its texts is read,
+    # and the last `cache` of them stay in an LRU. Dropped chunks leave None behind and their bytes in
+    # place, so hits handed out before a refresh still read their text
+    def __init__(self, block=TEXT_BLOCK, cache=TEXT_CACHE):
+        self.block, self.cache = block, cache
+        self._blocks = []; self._open = bytearray(); self._src = None  # the block being filled
+        self._blk = array("I"); self._off = array("I"); self._recs = []; self._vals = {}
+        self._lru = OrderedDict(); self._lock = threading.Lock()
+    def append(self, d):
+        rec = Chunk.__new__(Chunk); rec._store = self; rec._i = len(self._recs); rec.id = d["id"]
+        for f in META_FIELDS:
+            v = d.get(f); setattr(rec, f, v if v is None else self._vals.setdefault(v, v))
+        rec.aliases = list(d.get("aliases", ()))  # ids of near-duplicate chunks collapsed into this one
+        b = d["text"].encode()
+        if d.get("source")!=self._src or self.block and self._open and len(self._open)+len(b)>self.block:
+            self.seal()
+        self._src = d.get("source")
+        self._blk.append(len(self._blocks)); self._off.append(len(self._open)); self._open += b; self._recs.append(rec)
+        return rec
+    def extend(self, other):
+        # appends a sealed store built elsewhere (a worker's _Segment), taking over its blocks as they are
+        self.seal(); base = len(self._blocks)
+        for d in other._recs:
+            rec = Chunk.__new__(Chunk); rec._store = self; rec._i = len(self._recs); rec.id = d.id
+            for f in META_FIELDS:
+                v = getattr(d, f); setattr(rec, f, v if v is None else self._vals.setdefault(v, v))
+            rec.aliases = d.aliases; self._recs.append(rec)
+        self._blk.extend(map(base.__add__, other._blk)); self._off.extend(other._off); self._blocks += other._blocks
+    def seal(self):
+        # closes the block being filled (Retriever does after every batch of appends)
+        if self._blk and self._blk[-1]==len(self._blocks):
+            self._blocks.append(zlib.compress(self._open) if self.block else bytes(self._open))
+        self._open = bytearray(); self._src = None
+    def _block(self, b):
+        if b==len(self._blocks): return self._open
+        if not self.block: return self._blocks[b]
+        with self._lock:
+            raw = self._lru.get(b)
+            if raw is not None: self._lru.move_to_end(b); return raw
+        raw = zlib.decompress(self._blocks[b])
+        with self._lock:
+            self._lru[b] = raw
+            while len(self._lru)>self.cache: self._lru.popitem(last=False)
+        return raw
+    def text(self, i):
+        b = self._blk[i]; raw = self._block(b)
+        end = self._off[i+1] if i+1<len(self._blk) and self._blk[i+1]==b else len(raw)
+        return raw[self._off[i]:end].decode()
+    def nbytes(self):
+        # text storage as held between queries: blocks, the open block and the LRU
+        return (sum(map(len, self._blocks)) + len(self._open) + sum(map(len, self._lru.values()))
+                + len(self._blk)*self._blk.itemsize + len(self._off)*self._off.itemsize)
+    def __getstate__(self):
+        st = self.__dict__.copy(); del st["_lru"], st["_lock"]; return st
+    def __setstate__(self, st):
+        self.__dict__.update(st); self._lru = OrderedDict(); self._lock = threading.Lock()
+    def drop(self, i): self._recs[i] = None
+    def __len__(self): return len(self._recs)
+    def __getitem__(self, i): return self._recs[i]
+    def __iter__(self): return iter(self._recs)
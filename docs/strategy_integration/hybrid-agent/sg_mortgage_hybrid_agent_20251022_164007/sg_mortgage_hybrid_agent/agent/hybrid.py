@@ -0,0 +1,31 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+RRF_K = 60
+
+class HybridRetriever:
+    # Reciprocal-rank fusion of a lexical Retriever (cosine/BM25) and a DenseRetriever. Each side returns
+    # at most `pool` candidates; fusion is one pass over those, so cost is bounded by the pool, not the KB.
+    def __init__(self, lexical, dense, pool=50, rrf_k=RRF_K, weights=(1.0, 1.0), parallel=True):
+        self.lexical, self.dense = lexical, dense
+        self.pool, self.rrf_k, self.weights = pool, rrf_k, weights
+        # the dense side spends most of its time in NumPy with the GIL released, so running it on a
+        # helper thread while the lexical side scores keeps latency near the slower of the two
+        self._pool = ThreadPoolExecutor(max_workers=1) if parallel else None
+    def close(self):
+        if self._pool: self._pool.shutdown()
+    def search(self, query, k=4):
+        if self._pool:
+            dense = self._pool.submit(self.dense.search, query, self.pool)
+            pools = [self.lexical.search(query, self.pool), dense.result()]
+        else:
+            pools = [self.lexical.search(query, self.pool), self.dense.search(query, self.pool)]
+        fused = {}; first = {}
+        for w,hits in zip(self.weights, pools):
+            # zero-score filler (cosine padding) carries no evidence and gets no rank credit
+            for rank,h in enumerate(h for h in hits if h["score"]>0):
+                fused[h["id"]] = fused.get(h["id"], 0.0) + w/(self.rrf_k+rank+1)
+                first.setdefault(h["id"], h)
+        top = heapq.nsmallest(k, fused.items(), key=lambda x:(-x[1], x[0]))
+        # only the fused top k read their text; lexical hits decode it lazily
+        return [ {"id":i, "text":first[i]["text"], "score":s} for i,s in top ]
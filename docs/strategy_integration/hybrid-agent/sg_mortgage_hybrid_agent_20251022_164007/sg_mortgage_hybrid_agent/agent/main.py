@@ -1,11 +1,13 @@
 import argparse, json
 from pathlib import Path
-from agent.retrieval import Retriever
+from agent.retrieval import Retriever, QueryCache
 from agent.tools import recommend_packages, mortgage_math, macro_view
 
 BASE = Path(__file__).resolve().parents[1]
 SCHEMA = json.loads((BASE/"agent/schema.json").read_text(encoding="utf-8"))
-retriever = Retriever(str(BASE/"data/kb"))
+retriever = Retriever(str(BASE/"data/kb"), cache_path=str(BASE/"data/.cache/kb_index.pkl"),
+                      query_cache=QueryCache(maxsize=1024, ttl=600), positions=True)
+SNIPPET_CHARS = 400  # per-hit context budget: the densest window around the query's terms
 
 def wrap(kind="final_answer", tool_name="none", args=None, answer="", citations=None, structured=None):
     return {
@@ -24,7 +26,7 @@ def decide(query:str):
     return "packages"
 
 def run_agent(query:str):
-    hits = retriever.search(query, k=4)
+    hits = retriever.search(query, k=4, snippet_chars=SNIPPET_CHARS)
     ctx = "\n\n".join([f"[[{h['id']}]] {h['text']}" for h in hits])
     citations = [h["id"] for h in hits[:3]]
     intent = decide(query)
@@ -0,0 +1,150 @@
+import argparse, mmap, os, struct, sys
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
+from pathlib import Path
+from agent.docstore import META_FIELDS
+from agent.retrieval import Retriever, BM25_K1, _tokenize, _vectorize, _normalize, _idf, _topk
+
+# Packed, read-only index: one file that every worker process maps, so the KB lives once in the page cache.
+#   header   magic, version, scorer, byte order, n_docs, n_terms, avgdl, then (offset, length) per section
+#   sections vocab offsets/blob (terms sorted by UTF-8 bytes), CSR postings (indptr, doc ids, weights),
+#            chunk id offsets/blob, chunk text offsets/blob, bm25 length norms, metadata: the distinct
+#            (field, value) pairs (field index, _UNSET bit for a None value, value offsets/blob), each
+#            chunk's pair per META_FIELDS entry, one chunk bitmap per pair, each chunk's aliases ("\0"-joined)
+MAGIC, VERSION = b"SGKBPACK", 2
+SECTIONS = ("vocab_off","vocab","indptr","post_docs","post_w","id_off","ids","text_off","text","knorm",
+            "mfield","mval_off","mvals","meta","bitmaps","alias_off","aliases")
+_FMT = {"vocab_off":"Q","vocab":"B","indptr":"Q","post_docs":"I","post_w":"d",
+        "id_off":"Q","ids":"B","text_off":"Q","text":"B","knorm":"d",
+        "mfield":"B","mval_off":"Q","mvals":"B","meta":"I","bitmaps":"B","alias_off":"Q","aliases":"B"}
+_UNSET = 0x80
+_HEAD = struct.Struct("=8sIIIIId" + "QQ"*len(SECTIONS))
+_SCORERS = ("cosine","bm25")
+
+def _blob(items):
+    off = array("Q",[0]); out = bytearray()
+    for b in items:
+        out += b; off.append(len(out))
+    return off, out
+
+def write_packed(retriever, path):
+    r = retriever
+    live = [i for i,d in enumerate(r.docs) if d is not None]
+    remap = {i:j for j,i in enumerate(live)}  # tombstoned chunks are compacted away on write
+    terms = sorted((t for t,tid in r.vocab.items() if r.index[tid][0]), key=lambda t:t.encode())
+    indptr = array("Q",[0]); docs = array("I"); ws = array("d")
+    for t in terms:
+        pd, pw = r.index[r.vocab[t]]
+        docs.extend(remap[i] for i in pd); ws.extend(pw)
+        indptr.append(len(docs))
+    vocab_off, vocab = _blob(t.encode() for t in terms)
+    id_off, ids = _blob(r.docs[i]["id"].encode() for i in live)
+    text_off, text = _blob(r.docs[i]["text"].encode() for i in live)
+    knorm = array("d", (r.knorm[i] for i in live))
+    pairs = {}; meta = array("I")
+    for i in live:
+        for f,name in enumerate(META_FIELDS):
+            meta.append(pairs.setdefault((f, r.docs[i][name]), len(pairs)))
+    nbytes = (len(live)+7)//8; bitmaps = bytearray(nbytes*len(pairs))
+    for j,p in enumerate(meta):
+        i = j//len(META_FIELDS); bitmaps[p*nbytes + (i>>3)] |= 1<<(i&7)
+    mfield = array("B", (f|_UNSET if v is None else f for f,v in pairs))
+    mval_off, mvals = _blob(b"" if v is None else v.encode() for _,v in pairs)
+    alias_off, aliases = _blob("\0".join(r.docs[i]["aliases"]).encode() for i in live)
+    parts = dict(vocab_off=vocab_off, vocab=vocab, indptr=indptr, post_docs=docs, post_w=ws,
+                 id_off=id_off, ids=ids, text_off=text_off, text=text, knorm=knorm, mfield=mfield,
+                 mval_off=mval_off, mvals=mvals, meta=meta, bitmaps=bitmaps, alias_off=alias_off, aliases=aliases)
+    table = []; pos = _HEAD.size
+    for name in SECTIONS:
+        pos += -pos % 8  # 8-byte aligned so every section can be cast in place
+        n = len(memoryview(parts[name]).cast("B")); table += [pos, n]; pos += n
+    path = Path(path); path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name+f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEAD.pack(MAGIC, VERSION, _SCORERS.index(r.scorer), sys.byteorder=="little",
+                           len(live), len(terms), r.avgdl, *table))
+        for name, off in zip(SECTIONS, table[::2]):
+            f.write(b"\0"*(off-f.tell())); f.write(parts[name])
+    # replaced atomically: workers still mapping the old file keep a valid (old) inode
+    os.replace(tmp, path)
+
+class PackedRetriever:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mm)
+        magic, version, scorer, little, self.n_live, self.n_terms, self.avgdl, *table = _HEAD.unpack_from(buf)
+        if magic!=MAGIC or version!=VERSION: raise ValueError(f"not a packed KB index: {path}")
+        if bool(little)!=(sys.byteorder=="little"): raise ValueError(f"packed index byte order mismatch: {path}")
+        self.scorer = _SCORERS[scorer]
+        for name, off, n in zip(SECTIONS, table[::2], table[1::2]):
+            setattr(self, "_"+name, buf[off:off+n].cast(_FMT[name]))
+        self._buf = buf
+        # the value table is small: decoded once, as field -> value -> pair index
+        self._values = [None if f & _UNSET else bytes(self._mvals[self._mval_off[p]:self._mval_off[p+1]]).decode()
+                        for p,f in enumerate(self._mfield)]
+        self._pairs = {f:{} for f in META_FIELDS}
+        for p,(f,v) in enumerate(zip(self._mfield, self._values)): self._pairs[META_FIELDS[f & ~_UNSET]][v] = p
+    def close(self):
+        for name in SECTIONS: getattr(self, "_"+name).release()
+        self._buf.release(); self._mm.close()
+    def _term(self, t):
+        key = t.encode(); lo, hi = 0, self.n_terms
+        off, vocab = self._vocab_off, self._vocab
+        while lo<hi:
+            mid = (lo+hi)//2; cur = bytes(vocab[off[mid]:off[mid+1]])
+            if cur==key: return mid
+            if cur<key: lo = mid+1
+            else: hi = mid
+        return None
+    def _doc(self, i):
+        d = {"id": bytes(self._ids[self._id_off[i]:self._id_off[i+1]]).decode(),
+             "text": bytes(self._text[self._text_off[i]:self._text_off[i+1]]).decode()}
+        for f,name in enumerate(META_FIELDS): d[name] = self._values[self._meta[i*len(META_FIELDS)+f]]
+        a = bytes(self._aliases[self._alias_off[i]:self._alias_off[i+1]]).decode()
+        d["aliases"] = a.split("\0") if a else []
+        return d
+    def _mask(self, where):
+        # same semantics as Retriever._mask, over the stored per-pair bitmaps
+        nb = (self.n_live+7)//8; mask = None
+        for f,want in where.items():
+            if f not in META_FIELDS: raise ValueError(f"unknown metadata field: {f}")
+            pairs = self._pairs[f]
+            if callable(want): vals = [v for v in pairs if want(v)]
+            elif isinstance(want, (list,tuple,set,frozenset)): vals = want
+            else: vals = [want]
+            m = 0
+            for v in vals:
+                p = pairs.get(v)
+                if p is not None: m |= int.from_bytes(self._bitmaps[p*nb:(p+1)*nb], "little")
+            mask = m if mask is None else mask & m
+        return mask.to_bytes(nb, "little")
+    def search(self, query, k=4, where=None):
+        tokens = _tokenize(query)
+        q = _normalize(_vectorize(tokens)) if self.scorer=="cosine" else Counter(tokens)
+        indptr, docs, ws, kn = self._indptr, self._post_docs, self._post_w, self._knorm
+        mb = self._mask(where) if where else None
+        acc = defaultdict(float)
+        for t,qw in q.items():
+            j = self._term(t)
+            if j is None: continue
+            a, b = indptr[j], indptr[j+1]
+            if self.scorer=="bm25":
+                qw *= _idf(b-a, self.n_live)*(BM25_K1+1)
+                for i,tf in zip(docs[a:b], ws[a:b]): acc[i] += qw*tf/(tf+kn[i])
+            else:
+                for i,w in zip(docs[a:b], ws[a:b]): acc[i] += qw*w
+        if mb is not None: acc = {i:s for i,s in acc.items() if mb[i>>3]>>(i&7) & 1}
+        scored = _topk(acc.items(), k)
+        if self.scorer=="cosine" and len(scored)<k:
+            pad = (i for i in range(self.n_live) if i not in acc and (mb is None or mb[i>>3]>>(i&7) & 1))
+            scored += islice(((i,0.0) for i in pad), k-len(scored))
+        return [ {**self._doc(i), "score":s} for i,s in scored[:k] ]
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("kb_dir"); ap.add_argument("out")
+    ap.add_argument("--scorer", choices=_SCORERS, default="cosine")
+    args = ap.parse_args()
+    write_packed(Retriever(args.kb_dir, scorer=args.scorer), args.out)
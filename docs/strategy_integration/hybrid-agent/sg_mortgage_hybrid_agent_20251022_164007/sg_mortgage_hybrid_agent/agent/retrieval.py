@@ -1,44 +1,824 @@
-import re, math
-from collections import Counter
+import re, math, heapq, hashlib, os, pickle, struct, threading, time
+from bisect import bisect_left
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, islice, repeat
+from operator import mul
 from pathlib import Path
+from agent.dedup import MinHashLSH, minhash
+from agent.docstore import META_FIELDS, TEXT_BLOCK, TEXT_CACHE, DocStore, Hit
+
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9%\.]+")
+_PHRASE_RE = re.compile(r'"([^"]*)"')
 
 def _tokenize(text):
-    return [t.lower() for t in re.findall(r"[a-zA-Z0-9%\.]+", text)]
+    return [t.lower() for t in _TOKEN_RE.findall(text)]
 
 def _vectorize(tokens):
     c = Counter(tokens); n = sum(c.values()) or 1
     return {k:v/n for k,v in c.items()}
 
-def _cos(a,b):
-    keys = set(a.keys()) | set(b.keys())
-    num = sum(a.get(k,0)*b.get(k,0) for k in keys)
-    da = math.sqrt(sum((a.get(k,0))**2 for k in keys))
-    db = math.sqrt(sum((b.get(k,0))**2 for k in keys))
-    if da==0 or db==0: return 0.0
-    return num/(da*db)
-
-def load_kb(kb_dir):
-    docs = []
-    p = Path(kb_dir)
-    for fp in p.glob("*.md"):
-        text = fp.read_text(encoding="utf-8")
-        words = text.split()
-        cur=[]; size=0; chunks=[]
-        for w in words:
-            cur.append(w); size += len(w)+1
-            if size>1200:
-                chunks.append(" ".join(cur)); cur=[]; size=0
-        if cur: chunks.append(" ".join(cur))
-        for i,ch in enumerate(chunks):
-            docs.append({"id": f"{fp.stem}#{i}", "text": ch})
-    return docs
+BM25_K1, BM25_B = 1.2, 0.75
+
+def _idf(df, n):
+    return math.log(1 + (n-df+0.5)/(df+0.5))
+
+def _normalize(v):
+    n = math.sqrt(sum(w*w for w in v.values()))
+    return {k:w/n for k,w in v.items()} if n else {}
+
+def _dot(qv, v, kn=None):
+    # query (tid, weight) pairs against one id-sorted chunk vector; with `kn` the chunk holds raw bm25
+    # counts. Sums in query order, like postings accumulation, so both paths give identical floats.
+    vi, vw = v; s = 0.0
+    for tid,qw in qv:
+        j = bisect_left(vi, tid)
+        if j<len(vi) and vi[j]==tid:
+            w = vw[j]; s += qw*w/(w+kn) if kn is not None else qw*w
+    return s
+
+def _varints(nums):
+    # ascending ints as LEB128 gaps: positions within a chunk are small deltas, mostly one byte each
+    out = bytearray(); prev = 0
+    for n in nums:
+        g = n-prev; prev = n
+        while g>=0x80: out.append(g & 0x7F | 0x80); g >>= 7
+        out.append(g)
+    return out
+
+def _unvarints(buf):
+    out = []; cur = shift = prev = 0
+    for b in buf:
+        cur |= (b & 0x7F) << shift
+        if b & 0x80: shift += 7
+        else: prev += cur; out.append(prev); cur = shift = 0
+    return out
+
+def _gap(a, b):
+    # smallest distance between two ascending position lists
+    i = j = 0; best = None
+    while i<len(a) and j<len(b):
+        d = a[i]-b[j]
+        if best is None or abs(d)<best: best = abs(d)
+        if d<0: i += 1
+        else: j += 1
+    return best
+
+def _bits(mb):
+    # indices of the set bits of a little-endian bitmap, skipping zero bytes at C speed
+    for m in re.finditer(rb"[^\x00]", mb):
+        j = m.start(); byte = mb[j]
+        for b in range(8):
+            if byte>>b & 1: yield (j<<3)+b
+
+def _freeze(where):
+    return tuple(sorted(((f, frozenset(v) if isinstance(v, (list,tuple,set,frozenset)) else v)
+                         for f,v in where.items()), key=lambda x:x[0]))
+
+def _topk(scored, k):
+    # bounded heap, O(n log k); ties go to the lower chunk index so results are deterministic
+    return heapq.nsmallest(k, scored, key=lambda x:(-x[1], x[0]))
+
+CHUNK_SIZE = 1200
+
+_BANK_RE = re.compile(r"\b(dbs|posb|ocbc|uob|hsbc|scb|standard chartered|maybank|citibank|citi|cimb|rhb|boc|"
+                      r"bank of china|hlf|hong leong|sbi|icbc)\b")
+_BANKS = {"posb":"DBS", "scb":"Standard Chartered", "citi":"Citibank", "boc":"Bank of China",
+          "hlf":"Hong Leong Finance", "hong leong":"Hong Leong Finance"}
+_DATE_RE = re.compile(r"\b(?:19|20)\d\d-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01])\b")
+_HEADING_RE = re.compile(r"#{1,6}")
+
+def _bank(*texts):
+    for t in texts:
+        m = _BANK_RE.search(re.sub(r"[_\-]+", " ", t or "").lower())
+        if m: return _BANKS.get(m.group(1), m.group(1).upper() if len(m.group(1))<=4 else m.group(1).title())
+    return None
+
+def _iter_words(fh, block=1<<16):
+    # whitespace-split a file block by block, yielding (word, first word on its line); a word cut at a
+    # block edge is carried into the next block
+    tail = ""; first = True
+    while True:
+        buf = fh.read(block)
+        if not buf: break
+        parts = (tail+buf).split("\n"); tail = ""
+        for j,part in enumerate(parts):
+            if j: first = True
+            words = part.split()
+            if j==len(parts)-1 and part and not part[-1].isspace(): tail = words.pop()
+            for w in words:
+                yield w, first; first = False
+    if tail: yield tail, first
+
+def iter_chunks(fp, size=CHUNK_SIZE, overlap=0):
+    # streams ~size-char chunks; each chunk after the first repeats up to `overlap` chars of trailing words.
+    # Metadata: source file, the markdown heading in effect where the chunk starts, its effective date (latest
+    # ISO date in the chunk, else the last one seen earlier in the file) and the bank named by file or heading
+    if not 0<=overlap<size: raise ValueError(f"overlap must be in [0, {size}), got {overlap}")
+    fp = Path(fp)
+    def chunk(i, words, heading, date):
+        text = " ".join(words); section = " ".join(heading) or None
+        return {"id": f"{fp.stem}#{i}", "text": text, "source": fp.name, "section": section,
+                "date": max(_DATE_RE.findall(text), default=date), "bank": _bank(fp.stem, section)}
+    with open(fp, encoding="utf-8") as fh:
+        cur=[]; n=0; fresh=0; i=0
+        heading = []; in_heading = False; start = heading; date = None
+        for w,first in _iter_words(fh):
+            if first:
+                in_heading = bool(_HEADING_RE.fullmatch(w))
+                if in_heading: heading = []
+            elif in_heading and len(heading)<20: heading.append(w)
+            if not fresh: start = heading
+            cur.append(w); n += len(w)+1; fresh += 1
+            if n>size:
+                c = chunk(i, cur, start, date); date = c["date"]; yield c; i += 1
+                keep=[]; n=0
+                for w in reversed(cur):
+                    if n+len(w)+1>overlap: break
+                    keep.append(w); n += len(w)+1
+                cur = keep[::-1]; fresh = 0
+        if fresh: yield chunk(i, cur, start, date)
+
+def iter_kb(kb_dir, size=CHUNK_SIZE, overlap=0):
+    for fp in Path(kb_dir).glob("*.md"):
+        yield from iter_chunks(fp, size, overlap)
+
+def load_kb(kb_dir, size=CHUNK_SIZE, overlap=0, dedup=None):
+    # dedup=<Jaccard threshold>: near-duplicate chunks collapse into the first one seen, which lists
+    # their ids under "aliases"
+    if not dedup: return list(iter_kb(kb_dir, size, overlap))
+    lsh = MinHashLSH(dedup); out = []
+    for d in iter_kb(kb_dir, size, overlap):
+        sig = minhash(_tokenize(d["text"])); c = lsh.query(sig)
+        if c is None: lsh.add(len(out), sig); out.append({**d, "aliases": []})
+        else: out[c]["aliases"].append(d["id"])
+    return out
+
+def _kb_files(kb_dir, only=None):
+    return [fp for fp in Path(kb_dir).glob("*.md") if only is None or fp.name in only]
+
+_TYPECODES = {"float64":"d", "float16":"H", "int8":"B"}
+
+def _quantize(ws, precision):
+    # one chunk's weights -> (codes to store, the weights they decode to, int8 scale)
+    if precision=="float64": return ws, ws, None
+    if precision=="float16":
+        b = struct.pack(f"{len(ws)}e", *ws)
+        return struct.unpack(f"{len(ws)}H", b), struct.unpack(f"{len(ws)}e", b), None
+    s = max(ws, default=0.0)/255 or 1.0
+    codes = [max(1, round(w/s)) for w in ws]  # never 0, so a posting never decodes to "absent"
+    return codes, [c*s for c in codes], s
+
+class _Segment:
+    # one file's finished share of the index with file-local ids: chunk i is the file's i-th, token t its
+    # t-th distinct one in order of first occurrence, which is the order a serial build interns them in.
+    # Flat arrays, so it pickles compactly: token t's postings are [ptr[t], ptr[t+1]) of pdocs/praw (chunk,
+    # weight code) and of the position blob ranges poff/pblob, with its largest decoded weight in pmax and
+    # shortest chunk in pmin; chunk i's vector is [vptr[i], vptr[i+1]) of vids/vraw
+    __slots__ = ("stem", "terms", "ptr", "pdocs", "praw", "pmax", "pmin", "poff", "pblob",
+                 "vptr", "vids", "vraw", "lens", "scale", "docs")
+
+def _segment(fp, chunks, precision, positions, text_block):
+    # chunk vectors are laid out first, chunk by chunk; postings are the same entries stably sorted by token
+    tc = _TYPECODES[precision]; local = {}; blobs = []
+    seg = _Segment(); seg.stem = Path(fp).stem
+    seg.vptr = array("I", [0]); seg.vids = array("I"); seg.vraw = array(tc); vals = array("d"); owner = array("I")
+    seg.lens = array("I"); seg.scale = array("d") if precision=="int8" else None; seg.docs = DocStore(text_block)
+    for i,(d,dl,v,pos,_) in enumerate(chunks):
+        terms = sorted((local.setdefault(t, len(local)), w, t) for t,w in v.items())
+        codes, decoded, sc = _quantize([w for _,w,_ in terms], precision)
+        if sc is not None: seg.scale.append(sc)
+        seg.vids.extend(lid for lid,_,_ in terms); seg.vraw.extend(codes); seg.vptr.append(len(seg.vids))
+        vals.extend(decoded); owner.extend(repeat(i, len(terms)))
+        if positions: blobs.extend(_varints(pos[t]) for _,_,t in terms)
+        seg.lens.append(dl); seg.docs.append(d)
+    seg.docs.seal(); seg.terms = list(local)
+    order = sorted(range(len(seg.vids)), key=seg.vids.__getitem__)
+    seg.pdocs = array("I", map(owner.__getitem__, order)); seg.praw = array(tc, map(seg.vraw.__getitem__, order))
+    n = Counter(seg.vids); seg.ptr = ptr = array("I", accumulate((n[t] for t in range(len(local))), initial=0))
+    pv = array("d", map(vals.__getitem__, order)); pl = array("I", map(seg.lens.__getitem__, seg.pdocs))
+    seg.pmax = array("d", (max(pv[a:b]) for a,b in zip(ptr, islice(ptr, 1, None))))
+    seg.pmin = array("I", (min(pl[a:b]) for a,b in zip(ptr, islice(ptr, 1, None))))
+    seg.poff = seg.pblob = None
+    if positions:
+        ob = list(map(blobs.__getitem__, order))
+        seg.pblob = b"".join(ob); seg.poff = array("I", accumulate(map(len, ob), initial=0))
+    return seg
+
+def _index_file(fp, size, overlap, scorer, positions=False, dedup=False, precision="float64", text_block=None,
+                segment=False):
+    # per-file half of indexing, safe to run in a worker process: chunk, tokenize and weigh. With `segment`
+    # the file's postings, vectors and text blocks are built here too, as a _Segment the parent only has to
+    # renumber and append; not with dedup, whose collapsing is an order-dependent decision across files
+    # that the parent makes one chunk at a time
+    out = []
+    for d in iter_chunks(fp, size, overlap):
+        tokens = _tokenize(d["text"]); tf = Counter(tokens); pos = None
+        if positions:
+            pos = defaultdict(list)
+            for p,t in enumerate(tokens): pos[t].append(p)
+        # cosine vectors are unit-normalized once so scoring is a plain sparse dot product; bm25 keeps raw
+        # term counts and applies the corpus-dependent IDF/length terms at query time
+        out.append((d, len(tokens), tf if scorer=="bm25" else _normalize(_vectorize(tf)), pos,
+                    minhash(tokens) if dedup else None))
+    if not segment or dedup: return out
+    return _segment(fp, out, precision, positions, TEXT_BLOCK if text_block is None else text_block)
+
+def _index_kb(files, size, overlap, scorer, workers=None, positions=False, dedup=False, precision="float64",
+              text_block=None):
+    # one _index_file result per file, in file order. A serial build merges chunk by chunk (segments would
+    # only add a renumbering pass); workers hand back segments so the parent's share stays small
+    if not workers or workers<=1 or len(files)<2:
+        for fp in files: yield _index_file(fp, size, overlap, scorer, positions, dedup)
+        return
+    args = (files, repeat(size), repeat(overlap), repeat(scorer), repeat(positions), repeat(dedup),
+            repeat(precision), repeat(text_block), repeat(True))
+    with ProcessPoolExecutor(workers) as ex:
+        # map() yields in submission order, so the merge sees files exactly as the serial path does
+        yield from ex.map(_index_file, *args, chunksize=max(1, len(files)//(workers*4)))
+
+class QueryCache:
+    # LRU result cache with per-entry TTL; Retriever clears it whenever its index changes
+    def __init__(self, maxsize=1024, ttl=600.0, clock=time.monotonic):
+        self.maxsize, self.ttl, self.clock = maxsize, ttl, clock
+        self._data = OrderedDict(); self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.clock()-item[0] > self.ttl:
+                del self._data[key]; self.expirations += 1; item = None
+            if item is None:
+                self.misses += 1; return None
+            self._data.move_to_end(key); self.hits += 1
+            return item[1]
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock(), value); self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False); self.evictions += 1
+    def clear(self):
+        with self._lock: self._data.clear()
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
+
+PRECISIONS = ("float64", "float16", "int8")
+
+class _Half:
+    # float16 weights kept as raw 16-bit patterns (half the bytes of a double); reads decode to floats
+    __slots__ = ("raw",)
+    def __init__(self, raw=None): self.raw = array("H") if raw is None else raw
+    def __len__(self): return len(self.raw)
+    def __getitem__(self, j): return struct.unpack_from("e", self.raw, 2*j)[0]
+    def __iter__(self): return iter(struct.unpack(f"{len(self.raw)}e", self.raw))
+
+class _Scaled:
+    # uint8 codes times their chunk's scale (largest weight in the chunk / 255). `docs` holds each code's
+    # chunk for a postings list, or is the chunk index itself for a chunk vector
+    __slots__ = ("raw", "docs", "scale")
+    def __init__(self, docs, scale, raw=None):
+        self.raw = array("B") if raw is None else raw; self.docs = docs; self.scale = scale
+    def __len__(self): return len(self.raw)
+    def __getitem__(self, j):
+        d = self.docs; return self.raw[j]*self.scale[d if type(d) is int else d[j]]
+    def __iter__(self):
+        d = self.docs
+        return map(mul, self.raw, repeat(self.scale[d]) if type(d) is int else map(self.scale.__getitem__, d))
+
+INDEX_VERSION = 13
+_MERGE_COST = 64  # rough cost of one chunk-vector merge, in postings entries
+_COMPACT_AT = 0.25  # share of tombstoned chunk slots at which refresh() compacts the index
+_STATE = ("docs","lens","vecs","index","vocab","owner","files","maxw","mindl","ipos","lsh","alias_nnz","scale")
+
+def _sha256(fp, block=1<<20):
+    # streamed, so hashing a large KB file holds one block in memory, not the file
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for b in iter(lambda: f.read(block), b""): h.update(b)
+    return h.hexdigest()
+
+def _fingerprint(files, prev=None):
+    # content hashes are reused from `prev` for files whose size and mtime did not move
+    out = {}; prev = prev or {}
+    for fp in files:
+        st = fp.stat(); old = prev.get(fp.name)
+        if old and old[:2]==(st.st_size, st.st_mtime_ns): out[fp.name] = old
+        else: out[fp.name] = (st.st_size, st.st_mtime_ns, _sha256(fp))
+    return out
 
 class Retriever:
-    def __init__(self, kb_dir):
-        self.docs = load_kb(kb_dir)
-        self.vecs = [_vectorize(_tokenize(d["text"])) for d in self.docs]
-    def search(self, query, k=4):
-        qv = _vectorize(_tokenize(query))
-        scored = [(i, _cos(qv, v)) for i,v in enumerate(self.vecs)]
-        scored.sort(key=lambda x:x[1], reverse=True)
-        return [ {**self.docs[i], "score":s} for i,s in scored[:k] ]
+    def __init__(self, kb_dir, scorer="cosine", cache_path=None, chunk_size=CHUNK_SIZE, overlap=0, query_cache=None,
+                 workers=None, files=None, prune=None, positions=False, dedup=None, precision="float64",
+                 backend=None, text_block=TEXT_BLOCK, text_cache=TEXT_CACHE):
+        if scorer not in ("cosine","bm25"): raise ValueError(f"unknown scorer: {scorer}")
+        if precision not in PRECISIONS: raise ValueError(f"unknown precision: {precision}")
+        self.scorer = scorer; self.chunking = (chunk_size, overlap); self.query_cache = query_cache
+        # MaxScore early termination in _search; results are identical either way. On by default for bm25
+        # only: without idf, cosine bounds on common tokens stay too high to cut anything
+        self.prune = scorer=="bm25" if prune is None else prune
+        self.positions = positions  # keep token positions in the postings (needed for snippets)
+        self.dedup = dedup  # Jaccard threshold for collapsing near-duplicate chunks at index time, or None
+        self.precision = precision  # how term weights are stored: doubles, float16 or int8 + per-chunk scale
+        self.text_block, self.text_cache = text_block, text_cache  # chunk text compression; see DocStore
+        self.kb_dir = kb_dir; self.cache_path = cache_path
+        self.only = None if files is None else frozenset(files)  # restrict the index to these file names
+        self.corpus = None  # (n, avgdl) of a larger corpus this index is one shard of; see set_corpus()
+        # A storage backend (e.g. agent.sqlite_backend.SQLiteBackend) takes over chunk storage and ranking:
+        # it has `scorers`, files() -> stored fingerprint, sync(kb_dir, fingerprint, chunking) -> changed
+        # names, search(query, k, where) -> hits and close(). No in-memory index is built then
+        self.backend = backend
+        if backend is not None:
+            if scorer not in backend.scorers: raise ValueError(f"{type(backend).__name__} cannot rank by {scorer}")
+            # options that shape the in-memory index have nothing to act on
+            unused = [name for name,v,default in (("cache_path", cache_path, None), ("workers", workers, None),
+                      ("prune", prune, None), ("positions", positions, False), ("dedup", dedup, None),
+                      ("precision", precision, "float64"), ("text_block", text_block, TEXT_BLOCK),
+                      ("text_cache", text_cache, TEXT_CACHE)) if v!=default]
+            if unused: raise ValueError(f"not supported with a storage backend: {', '.join(unused)}")
+            backend.sync(kb_dir, _fingerprint(_kb_files(kb_dir, self.only), backend.files()), self.chunking)
+            return
+        # a cache's header is read first: its file hashes are reused for files whose size and mtime match
+        head = self._cache_head() if cache_path else None
+        fp = _fingerprint(_kb_files(kb_dir, self.only), head and head["files"])
+        if not (head and head["files"]==fp and self._load_cache()):
+            self._build(_index_kb(_kb_files(kb_dir, self.only), *self.chunking, scorer, workers, positions,
+                                  bool(dedup), precision, text_block), fp)
+            if cache_path: self._save_cache()
+        self.docs.cache = text_cache
+        self._restat()
+    # The cache file is two pickles: a header of plain values (format version, the options that shape the
+    # index, file fingerprints), then the index state. The state is only unpickled once the header matches,
+    # so a cache from another version or configuration is rebuilt rather than loaded
+    def _head(self):
+        return {"version": INDEX_VERSION, "scorer": self.scorer, "chunking": self.chunking, "positions": self.positions,
+                "dedup": self.dedup, "precision": self.precision, "text_block": self.text_block}
+    def _cache_head(self):
+        try:
+            with open(self.cache_path, "rb") as f: head = pickle.load(f)
+        except Exception:
+            return None  # missing, truncated or not a cache
+        if not isinstance(head, dict) or {k:head.get(k) for k in self._head()}!=self._head(): return None
+        return head if isinstance(head.get("files"), dict) else None
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "rb") as f: pickle.load(f); state = pickle.load(f)
+            vals = [state[name] for name in _STATE]
+        except Exception:
+            return False  # truncated, or naming a class that has since moved
+        for name,v in zip(_STATE, vals): setattr(self, name, v)
+        return True
+    def _save_cache(self):
+        path = Path(self.cache_path); path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name+f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({**self._head(), "files": self.files}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump({name:getattr(self, name) for name in _STATE}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)  # atomic, so concurrent workers never read a half-written cache
+    def _build(self, docs, files):
+        self.docs = DocStore(self.text_block, self.text_cache); self.lens, self.vecs = [], []
+        # tokens are interned to int ids; vectors and postings are parallel (ids, weights) arrays, the
+        # chunk vectors sorted by token id. Weights stay doubles unless a lower `precision` is asked for
+        self.vocab = {}; self.index = []
+        self.scale = array("d") if self.precision=="int8" else None  # per-chunk int8 scale
+        # per-token score bounds for pruning: largest weight (cosine) or tf (bm25) in its postings, and for
+        # bm25 the shortest chunk length, which bounds the length norm whatever avgdl ends up being
+        self.maxw = array("d"); self.mindl = array("I")
+        # positional postings, parallel to `index`: per token, (offsets, blob) with the varint position gaps
+        # of its j-th posting in blob[offsets[j]:offsets[j+1]]
+        self.ipos = [] if self.positions else None
+        # near-duplicate collapsing: signatures of the indexed chunks, and postings each alias would have added
+        self.lsh = MinHashLSH(self.dedup) if self.dedup else None; self.alias_nnz = {}
+        self.owner = defaultdict(list)  # file stem -> chunk indices, so one file can be re-indexed alone
+        self.files = files
+        self._add(docs)
+    def _intern(self, t):
+        tid = self.vocab.get(t)
+        if tid is None:
+            tid = self.vocab[t] = len(self.index); docs = array("I"); self.index.append((docs, self._weights(docs)))
+            self.maxw.append(0.0); self.mindl.append(0xFFFFFFFF)
+            if self.ipos is not None: self.ipos.append((array("I", [0]), bytearray()))
+        return tid
+    def _weights(self, docs, raw=None):
+        # a weights container in this index's precision over `raw` stored codes (empty if None); `docs`
+        # as for _Scaled
+        if self.precision=="float16": return _Half(raw)
+        if self.precision=="int8": return _Scaled(docs, self.scale, raw)
+        return array("d") if raw is None else raw
+    def _add(self, parts):
+        # appends _index_file results: segments are renumbered and concatenated, deduplicated chunk lists
+        # go through the LSH one chunk at a time
+        for part in parts:
+            if isinstance(part, _Segment): self._merge(part)
+            else: self._add_chunks(part)
+        self.docs.seal()
+    def _merge(self, seg):
+        index = self.index; maxw = self.maxw; mindl = self.mindl; ipos = self.ipos
+        base = len(self.docs); remap = [self._intern(t) for t in seg.terms]
+        pdocs, praw, poff, pblob = seg.pdocs, seg.praw, seg.poff, seg.pblob
+        shift = base.__add__; direct = praw.typecode=="d"
+        for tid,a,b,mw,md in zip(remap, seg.ptr, islice(seg.ptr, 1, None), seg.pmax, seg.pmin):
+            docs, ws = index[tid]
+            docs.extend(map(shift, pdocs[a:b]) if base else pdocs[a:b])
+            (ws if direct else ws.raw).extend(praw[a:b])
+            if mw>maxw[tid]: maxw[tid] = mw
+            if md<mindl[tid]: mindl[tid] = md
+            if ipos is not None:
+                o, blob = ipos[tid]; o.extend(map((len(blob)-poff[a]).__add__, poff[a+1:b+1])); blob += pblob[poff[a]:poff[b]]
+        vptr, vids, vraw = seg.vptr, seg.vids, seg.vraw
+        for j in range(len(seg.lens)):
+            a, b = vptr[j], vptr[j+1]
+            g = list(map(remap.__getitem__, vids[a:b])); raw = vraw[a:b]
+            if g!=sorted(g):
+                # tokens seen in earlier files keep their older ids, which can reorder a chunk's vector
+                order = sorted(range(len(g)), key=g.__getitem__)
+                g = map(g.__getitem__, order); raw = array(raw.typecode, map(raw.__getitem__, order))
+            self.vecs.append((array("I", g), self._weights(base+j, raw)))
+        if seg.scale is not None: self.scale.extend(seg.scale)
+        self.lens.extend(seg.lens); self.docs.extend(seg.docs)
+        self.owner[seg.stem].extend(range(base, len(self.docs)))
+    def _add_chunks(self, indexed):
+        index = self.index; maxw = self.maxw; mindl = self.mindl; ipos = self.ipos
+        for d,dl,v,pos,sig in indexed:
+            i = len(self.docs)
+            if self.lsh is not None:
+                c = self.lsh.query(sig)
+                if c is not None:
+                    self.docs[c].aliases.append(d["id"]); self.alias_nnz[d["id"]] = len(v); continue
+                self.lsh.add(i, sig)
+            terms = sorted((self._intern(t), w, t) for t,w in v.items())
+            codes, vals, s = _quantize([w for _,w,_ in terms], self.precision)
+            if s is not None: self.scale.append(s)
+            raw = array(_TYPECODES[self.precision], codes)
+            ids = array("I", (tid for tid,_,_ in terms)); ws = self._weights(i, raw)
+            for (tid,_,t),c,w in zip(terms, codes, vals):
+                p = index[tid]; p[0].append(i)
+                if raw.typecode=="d": p[1].append(c)
+                else: p[1].raw.append(c)
+                if ipos is not None:
+                    off, blob = ipos[tid]; blob += _varints(pos[t]); off.append(len(blob))
+                if w>maxw[tid]: maxw[tid] = w
+                if dl<mindl[tid]: mindl[tid] = dl
+            self.docs.append(d); self.lens.append(dl); self.vecs.append((ids, ws))
+            self.owner[d["id"].rsplit("#",1)[0]].append(i)
+    def _drop(self, stems):
+        dead = {i for s in stems for i in self.owner.pop(s, ())}
+        # a file's chunks are one ascending run of ids and postings are sorted by id, so each run is one
+        # bisected slice of every postings list it touches; deleted back to front so earlier cuts hold
+        runs = []
+        for i in sorted(dead):
+            if runs and runs[-1][1]==i: runs[-1][1] = i+1
+            else: runs.append([i, i+1])
+        lens = self.lens
+        for tid in {t for i in dead for t in self.vecs[i][0]}:
+            docs, ws = self.index[tid]
+            raw = ws if isinstance(ws, array) else ws.raw
+            off, blob = self.ipos[tid] if self.ipos is not None else (None, None)
+            bound = False
+            for lo,hi in reversed(runs):
+                a = bisect_left(docs, lo); b = bisect_left(docs, hi, a)
+                if a==b: continue
+                # the bounds are rescanned only if a removed entry may have held them
+                gone = ws[a:b] if isinstance(ws, array) else [ws[j] for j in range(a, b)]
+                bound = bound or max(gone)>=self.maxw[tid] or min(map(lens.__getitem__, docs[a:b]))<=self.mindl[tid]
+                if off is not None:
+                    cut = off[b]-off[a]; del blob[off[a]:off[b]]
+                    off[a+1:] = array("I", map(cut.__rsub__, off[b+1:]))
+                del docs[a:b]; del raw[a:b]
+            if bound:
+                self.maxw[tid] = max(ws, default=0.0)
+                self.mindl[tid] = min(map(lens.__getitem__, docs), default=0xFFFFFFFF)
+        for i in dead:
+            if self.lsh is not None:
+                self.lsh.remove(i)
+                for a in self.docs[i].aliases: del self.alias_nnz[a]
+            # chunk slots are tombstoned so other postings keep their indices, until _compact renumbers
+            self.docs.drop(i); self.vecs[i] = (array("I"), self._weights(i)); self.lens[i] = 0
+    def _compact(self):
+        # drops tombstoned chunks and tokens left without postings. Ids are renumbered in their old order,
+        # so postings, chunk vectors and ties all keep their order. That order is the refresh order, not a
+        # fresh build's (refreshed files sit at the end): scores match a fresh build, equal-score ties may
+        # not. Live text moves to a fresh DocStore; hits handed out earlier keep the old one alive until
+        # they are gone
+        live = [i for i,d in enumerate(self.docs) if d is not None]
+        new = array("I", bytes(4*len(self.docs)))
+        for j,i in enumerate(live): new[i] = j
+        keep = [t for t,(docs,_) in enumerate(self.index) if docs]
+        tnew = array("I", bytes(4*len(self.index)))
+        for j,t in enumerate(keep): tnew[t] = j
+        raw = lambda ws: ws if isinstance(ws, array) else ws.raw
+        if self.scale is not None: self.scale = array("d", (self.scale[i] for i in live))
+        store = DocStore(self.text_block, self.text_cache)
+        for i in live: store.append(dict(self.docs[i]))
+        store.seal()
+        index = []
+        for t in keep:
+            docs, ws = self.index[t]; docs = array("I", (new[i] for i in docs))
+            index.append((docs, self._weights(docs, raw(ws))))
+        self.vecs = [(array("I", (tnew[t] for t in self.vecs[i][0])), self._weights(j, raw(self.vecs[i][1])))
+                     for j,i in enumerate(live)]
+        self.vocab = {tok:tnew[t] for tok,t in self.vocab.items() if self.index[t][0]}
+        self.maxw = array("d", (self.maxw[t] for t in keep)); self.mindl = array("I", (self.mindl[t] for t in keep))
+        if self.ipos is not None: self.ipos = [self.ipos[t] for t in keep]
+        self.owner = defaultdict(list, {s:[new[i] for i in idx] for s,idx in self.owner.items()})
+        if self.lsh is not None:
+            lsh = MinHashLSH(self.dedup)
+            for i,sig in sorted(self.lsh.sigs.items()): lsh.add(new[i], sig)
+            self.lsh = lsh
+        self.docs, self.index, self.lens = store, index, [self.lens[i] for i in live]
+    def _restat(self):
+        live = [dl for d,dl in zip(self.docs, self.lens) if d is not None]
+        self.n_live = len(live)
+        self.avgdl = sum(live)/len(live) if live else 0.0
+        avgdl = self.corpus[1] if self.corpus else self.avgdl
+        self.knorm = [BM25_K1*(1-BM25_B+BM25_B*dl/(avgdl or 1)) for dl in self.lens]
+        # one bitmap per metadata value (bit i = chunk i), rebuilt whenever the chunk set changes
+        nbytes = (len(self.docs)+7)//8; raw = {f:{} for f in META_FIELDS}
+        for i,d in enumerate(self.docs):
+            if d is None: continue
+            for f in META_FIELDS:
+                v = getattr(d, f); bm = raw[f].get(v)
+                if bm is None: bm = raw[f][v] = bytearray(nbytes)
+                bm[i>>3] |= 1<<(i&7)
+        self._bitmaps = {f:{v:int.from_bytes(bm, "little") for v,bm in vals.items()} for f,vals in raw.items()}
+        self._mat = None
+        if self.query_cache is not None: self.query_cache.clear()
+    def set_corpus(self, n, avgdl):
+        # score bm25 against the statistics of the whole corpus when this index is one shard of it
+        self.corpus = (n, avgdl); self._restat()
+    def refresh(self):
+        if self.backend is not None:
+            changed = self.backend.sync(self.kb_dir, _fingerprint(_kb_files(self.kb_dir, self.only), self.backend.files()),
+                                        self.chunking)
+            if changed and self.query_cache is not None: self.query_cache.clear()
+            return changed
+        files = _fingerprint(_kb_files(self.kb_dir, self.only), self.files)
+        changed = sorted(n for n in self.files.keys()|files.keys() if self.files.get(n)!=files.get(n))
+        if not changed: return []
+        stems = {Path(n).stem for n in changed}
+        if self.lsh is not None:
+            # aliases were never indexed: files whose chunks folded into a chunk being dropped must be
+            # re-read, and aliases from re-read files come off the canonicals that survive
+            grow = True
+            while grow:
+                more = {a.rsplit("#",1)[0] for s in stems for i in self.owner.get(s, ()) for a in self.docs[i].aliases}
+                grow = not more<=stems; stems |= more
+            for s,idx in self.owner.items():
+                if s in stems: continue
+                for i in idx:
+                    rec = self.docs[i]; gone = [a for a in rec.aliases if a.rsplit("#",1)[0] in stems]
+                    for a in gone: rec.aliases.remove(a); del self.alias_nnz[a]
+        self._drop(stems)
+        for n in sorted(n for n in files if Path(n).stem in stems):
+            self._add([_index_file(Path(self.kb_dir)/n, *self.chunking, self.scorer, self.positions, bool(self.dedup))])
+        if sum(d is None for d in self.docs) > _COMPACT_AT*len(self.docs): self._compact()
+        self.files = files
+        self._restat()
+        if self.cache_path: self._save_cache()
+        return changed
+    def dedup_report(self):
+        if self.backend is not None: raise ValueError("dedup_report needs the in-memory index (no backend)")
+        live = [v for d,v in zip(self.docs, self.vecs) if d is not None]
+        aliases = len(self.alias_nnz); postings = sum(len(v[0]) for v in live)
+        saved = sum(self.alias_nnz.values())
+        return {"threshold": self.dedup, "chunks_seen": len(live)+aliases, "chunks_indexed": len(live),
+                "aliases": aliases, "chunk_reduction": round(aliases/((len(live)+aliases) or 1), 4),
+                "postings": postings, "postings_saved": saved,
+                "postings_reduction": round(saved/((postings+saved) or 1), 4)}
+    def _query(self, query, df=None):
+        # (token id, weight) pairs for in-vocabulary query tokens; `df` overrides document frequencies
+        # (a sharded coordinator passes corpus-wide ones)
+        tokens = _tokenize(query); vocab = self.vocab
+        if self.scorer=="cosine":
+            return [(vocab[t], w) for t,w in _normalize(_vectorize(tokens)).items() if t in vocab]
+        qv = []; n = self.corpus[0] if self.corpus else self.n_live
+        for t,c in Counter(tokens).items():
+            if t not in vocab or not self.index[vocab[t]][0]: continue
+            d = df[t] if df is not None else len(self.index[vocab[t]][0])
+            qv.append((vocab[t], c*_idf(d, n)*(BM25_K1+1)))
+        return qv
+    def _mask(self, where):
+        # AND across fields, OR across the values listed for a field; a callable selects values by predicate
+        mask = None
+        for f,want in where.items():
+            if f not in META_FIELDS: raise ValueError(f"unknown metadata field: {f}")
+            bms = self._bitmaps[f]
+            if callable(want): vals = [v for v in bms if want(v)]
+            elif isinstance(want, (list,tuple,set,frozenset)): vals = want
+            else: vals = [want]
+            m = 0
+            for v in vals: m |= bms.get(v, 0)
+            mask = m if mask is None else mask & m
+        return mask
+    def search(self, query, k=4, where=None, snippet_chars=None, snippet_tokens=None, proximity=0.0):
+        snip = (snippet_chars, snippet_tokens)
+        if self.query_cache is None: return self._search(query, k, None, where, *snip, proximity)
+        # keyed on the token multiset: word order and case do not change the ranking (or the snippets),
+        # except through quoted phrases and, with a proximity boost, the order of the query tokens
+        tokens = _tokenize(query)
+        key = (tuple(tokens) if proximity else tuple(sorted(Counter(tokens).items())), k,
+               _freeze(where) if where else None, snip,
+               tuple(tuple(_tokenize(p)) for p in _PHRASE_RE.findall(query)), proximity)
+        hits = self.query_cache.get(key)
+        if hits is None:
+            hits = self._search(query, k, None, where, *snip, proximity); self.query_cache.put(key, hits)
+        return list(hits)
+    def _phrases(self, query):
+        # "quoted phrases" as token tuples; they need positions, without them quotes are plain text
+        if self.ipos is None: return ()
+        return tuple(dict.fromkeys(p for p in map(tuple, map(_tokenize, _PHRASE_RE.findall(query))) if p))
+    def _phrase_mask(self, phrase):
+        # bitmap of the chunks holding the tokens of `phrase` at consecutive positions, found by walking
+        # the rarest token's postings and probing the others; no chunk text is read
+        vocab = self.vocab; nbytes = (len(self.docs)+7)//8
+        if any(t not in vocab for t in phrase): return 0
+        tids = [vocab[t] for t in phrase]
+        rare = min(range(len(tids)), key=lambda j: len(self.index[tids[j]][0]))
+        bm = bytearray(nbytes)
+        for i in self.index[tids[rare]][0]:
+            starts = None
+            for j,tid in sorted(enumerate(tids), key=lambda x: x[0]!=rare):
+                ps = {p-j for p in self._positions(tid, i)}
+                starts = ps if starts is None else starts & ps
+                if not starts: break
+            if starts: bm[i>>3] |= 1<<(i&7)
+        return int.from_bytes(bm, "little")
+    def _positions(self, tid, i):
+        docs = self.index[tid][0]; j = bisect_left(docs, i)
+        if j==len(docs) or docs[j]!=i: return []
+        off, blob = self.ipos[tid]
+        return _unvarints(blob[off[j]:off[j+1]])
+    def _snippet(self, i, qv, chars=None, tokens=None):
+        # densest window of chunk i within the budget: most distinct query tokens, then most matches,
+        # located from the positional postings and then widened to fill the budget. The text is only
+        # scanned for token offsets, to cut the window on token boundaries
+        text = self.docs.text(i)
+        spans = [m.span() for m in _TOKEN_RE.finditer(text)]
+        if not spans: return text[:chars]
+        def fits(a, b):
+            return (chars is None or spans[b][1]-spans[a][0]<=chars) and (tokens is None or b-a<tokens)
+        marks = sorted((p, tid) for tid,_ in qv for p in self._positions(tid, i))
+        a = b = 0; best = (-1, -1); seen = Counter(); r = 0
+        for l,(p,_) in enumerate(marks):
+            # a lone match always counts, even if it alone overruns the budget
+            while r<len(marks) and (r==l or fits(p, marks[r][0])):
+                seen[marks[r][1]] += 1; r += 1
+            if (len(seen), r-l) > best: best = (len(seen), r-l); a, b = p, marks[r-1][0]
+            seen[marks[l][1]] -= 1
+            if not seen[marks[l][1]]: del seen[marks[l][1]]
+        grow = True
+        while grow:
+            grow = False
+            if b+1<len(spans) and fits(a, b+1): b += 1; grow = True
+            if a>0 and fits(a-1, b): a -= 1; grow = True
+        return text[spans[a][0]:spans[b][1]]
+    def _search(self, query, k, df=None, where=None, snippet_chars=None, snippet_tokens=None, proximity=0.0):
+        if self.backend is not None:
+            if snippet_chars or snippet_tokens: raise ValueError("snippets need the in-memory index (positions=True)")
+            if proximity: raise ValueError("proximity boosts need the in-memory index (positions=True)")
+            return self.backend.search(query, k, where)
+        qv = self._query(query, df); bm25 = self.scorer=="bm25"; kn = self.knorm
+        if (snippet_chars or snippet_tokens or proximity) and self.ipos is None:
+            raise ValueError("snippets and proximity boosts need positional postings: Retriever(..., positions=True)")
+        # quoted phrases narrow the candidates exactly like a metadata filter
+        mask = self._mask(where) if where else None
+        for p in self._phrases(query):
+            m = self._phrase_mask(p); mask = m if mask is None else mask & m
+        mb = None if mask is None else mask.to_bytes((len(self.docs)+7)//8, "little")
+        if mb is not None and mask.bit_count()*_MERGE_COST < sum(len(self.index[tid][0]) for tid,_ in qv):
+            # small subset: score just the selected chunks against the query
+            acc = {}
+            for i in _bits(mb):
+                s = _dot(qv, self.vecs[i], kn[i] if bm25 else None)
+                if s: acc[i] = s
+        elif mb is None and self.prune and k>0 and len(qv)>1 and not proximity:
+            acc = self._maxscore(qv, k)
+        else:
+            acc = defaultdict(float)
+            if bm25:
+                for tid,qw in qv:
+                    for i,tf in zip(*self.index[tid]): acc[i] += qw*tf/(tf+kn[i])
+            else:
+                for tid,qw in qv:
+                    for i,w in zip(*self.index[tid]): acc[i] += qw*w
+            if mb is not None: acc = {i:s for i,s in acc.items() if mb[i>>3]>>(i&7) & 1}
+        scored = self._proximity(acc, query, qv, k, proximity) if proximity else _topk(acc.items(), k)
+        if not bm25 and len(scored)<k:
+            # chunks sharing no query token score 0.0; pad in corpus order like a full scan would
+            # (bm25 returns only real matches so small-k contexts carry no filler)
+            docs = self.docs
+            pad = (i for i in range(len(docs)) if i not in acc and docs[i] is not None
+                   and (mb is None or mb[i>>3]>>(i&7) & 1))
+            scored += islice(((i,0.0) for i in pad), k-len(scored))
+        if snippet_chars or snippet_tokens:
+            return [ Hit(self.docs[i], s, self._snippet(i, qv, snippet_chars, snippet_tokens)) for i,s in scored[:k] ]
+        return [ Hit(self.docs[i], s) for i,s in scored[:k] ]
+    def _proximity(self, acc, query, qv, k, weight):
+        # each pair of neighbouring query tokens found in a chunk adds weight * (their mean query weight)
+        # / (closest distance between them). Candidates go best base score first and the scan stops once
+        # even the largest possible boost cannot lift the next one into the top k
+        if k<1: return []
+        qw = dict(qv); vocab = self.vocab
+        seq = [vocab[t] for t in _tokenize(query) if t in vocab and vocab[t] in qw]
+        pairs = [(a, b, weight*(qw[a]+qw[b])/2) for a,b in dict.fromkeys(zip(seq, seq[1:])) if a!=b]
+        most = sum(w for _,_,w in pairs); top = []
+        for i,s in sorted(acc.items(), key=lambda x:(-x[1], x[0])):
+            if len(top)>=k and s+most < top[0][0]-1e-9*(abs(top[0][0])+1): break
+            for a,b,w in pairs:
+                pa = self._positions(a, i)
+                if pa:
+                    pb = self._positions(b, i)
+                    if pb: s += w/_gap(pa, pb)
+            heapq.heappush(top, (s, -i))
+            if len(top)>k: heapq.heappop(top)
+        return sorted(((-i, s) for s,i in top), key=lambda x:(-x[1], x[0]))
+    def _maxscore(self, qv, k):
+        # Term-at-a-time MaxScore: terms go in decreasing order of their score bound. Once the bounds of
+        # the terms left sum below the k-th best partial score, no unseen chunk can make the top k, so
+        # those terms only update chunks already in play, and chunks that can no longer catch up are
+        # dropped. Common tokens (long postings, low bounds) come last and mostly cost a few lookups.
+        # Partial sums run in a different order from the exhaustive pass, so the final few candidates
+        # are rescored in query order (bit-identical scores) and every cut keeps a small float margin.
+        bm25 = self.scorer=="bm25"; kn = self.knorm; index = self.index; maxw = self.maxw
+        if bm25:
+            avgdl = (self.corpus[1] if self.corpus else self.avgdl) or 1
+            ub = [qw*maxw[t]/(maxw[t]+BM25_K1*(1-BM25_B+BM25_B*self.mindl[t]/avgdl)) for t,qw in qv]
+        else:
+            ub = [qw*maxw[t] for t,qw in qv]
+        order = sorted(range(len(qv)), key=lambda j:-ub[j])
+        rest = [0.0]*(len(order)+1)  # rest[x]: bound of the terms from position x on
+        for x in range(len(order)-1, -1, -1): rest[x] = rest[x+1] + ub[order[x]]
+        acc = defaultdict(float); cut = -1.0
+        for x,j in enumerate(order):
+            tid, qw = qv[j]; docs, ws = index[tid]
+            if rest[x] < cut:
+                # dropping hopeless chunks costs a pass over them; only worth it before a postings scan
+                if len(acc)*8 >= len(docs): acc = {i:s for i,s in acc.items() if s+rest[x] >= cut}
+                if len(acc)*8 < len(docs):
+                    for i in acc:
+                        p = bisect_left(docs, i)
+                        if p<len(docs) and docs[p]==i:
+                            w = ws[p]; acc[i] += qw*w/(w+kn[i]) if bm25 else qw*w
+                elif bm25:
+                    for i,tf in zip(docs, ws):
+                        if i in acc: acc[i] += qw*tf/(tf+kn[i])
+                else:
+                    for i,w in zip(docs, ws):
+                        if i in acc: acc[i] += qw*w
+            elif bm25:
+                for i,tf in zip(docs, ws): acc[i] += qw*tf/(tf+kn[i])
+            else:
+                for i,w in zip(docs, ws): acc[i] += qw*w
+            # the k-th partial score is at most the bound already spent, so it can only cut the remaining
+            # terms once that exceeds their bound; skip the O(candidates) selection until then
+            if len(acc)>=k and rest[0]-rest[x+1] > rest[x+1]:
+                theta = heapq.nlargest(k, acc.values())[-1]
+                cut = theta - 1e-9*(abs(theta)+1)
+        if len(acc)>=k:
+            acc = {i:s for i,s in acc.items() if s >= cut}
+        return {i:_dot(qv, self.vecs[i], kn[i] if bm25 else None) for i in acc}
+    def _matrix(self):
+        # term-major CSR view of the postings (one row per token id), built once for search_many
+        if self._mat is None:
+            import numpy as np
+            indptr = np.zeros(len(self.index)+1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(p[0]) for p in self.index])
+            docs = np.concatenate([np.zeros(0, np.uint32)]+[np.frombuffer(p[0], np.uint32) for p in self.index]).astype(np.int64)
+            data = np.concatenate([np.zeros(0)]+[np.frombuffer(p[1], np.float64) if isinstance(p[1], array)
+                                                 else np.fromiter(p[1], np.float64, len(p[1])) for p in self.index])
+            if self.scorer=="bm25": data = data/(data+np.asarray(self.knorm)[docs])
+            dead = np.array([i for i,d in enumerate(self.docs) if d is None], dtype=np.int64)
+            self._mat = (indptr, docs, data, dead)
+        return self._mat
+    def search_many(self, queries, k=4, batch=256):
+        if self.backend is not None: raise ValueError("search_many needs the in-memory index (no backend)")
+        import numpy as np
+        indptr, docs, data, dead = self._matrix()
+        n = len(self.docs); kk = min(k, self.n_live); out = []
+        if kk<=0: return [[] for _ in queries]
+        batch = max(1, min(batch, (1<<22)//n))  # cap the dense score block at ~32MB
+        for b in range(0, len(queries), batch):
+            qvs = [self._query(q) for q in queries[b:b+batch]]
+            hits = [(r,tid,w) for r,qv in enumerate(qvs) for tid,w in qv]
+            rows, cols, qw = (np.array(x) for x in zip(*hits)) if hits else (np.zeros(0,np.int64),)*3
+            lens = indptr[cols+1]-indptr[cols]
+            # expand every (query, term) pair into its postings range and scatter-add into one dense block
+            pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens)-lens, lens) + np.repeat(indptr[cols], lens)
+            scores = np.bincount(np.repeat(rows, lens)*n + docs[pos], weights=np.repeat(qw, lens)*data[pos],
+                                 minlength=len(qvs)*n).reshape(len(qvs), n)
+            scores[:, dead] = -1.0  # tombstoned chunks never make the cut
+            top = np.argpartition(-scores, kk-1, axis=1)[:, :kk]
+            vals = np.take_along_axis(scores, top, axis=1)
+            thr = vals.min(axis=1)
+            # rows whose cut-off value is shared with chunks left outside the partition (typically the
+            # zero-score padding) are re-picked so ties go to the earliest chunks, as in search()
+            for r in np.flatnonzero((scores>=thr[:,None]).sum(axis=1)>kk):
+                row = scores[r]; above = np.flatnonzero(row>thr[r])
+                top[r] = np.concatenate([above, np.flatnonzero(row==thr[r])[:kk-len(above)]])
+            vals = np.take_along_axis(scores, top, axis=1)
+            for sel, v in zip(top, vals):
+                o = np.lexsort((sel, -v))
+                out.append([ Hit(self.docs[i], s) for i,s in zip(sel[o].tolist(), v[o].tolist())
+                             if s>0 or self.scorer=="cosine" ])
+        return out
@@ -0,0 +1,101 @@
+import heapq, statistics, threading, time
+import multiprocessing as mp
+from collections import Counter, deque
+from itertools import islice
+from pathlib import Path
+from agent.retrieval import Retriever, _kb_files, _tokenize
+
+def _serve(conn, kb_dir, files, opts):
+    # shard worker: owns one Retriever over a subset of the KB files and answers the coordinator's requests.
+    # Replies are ("ok", result) or ("error", exc); a failed request leaves the worker serving, and one whose
+    # Retriever could not be built answers every request with that error until it is closed
+    try: r, err = Retriever(kb_dir, files=files, **opts), None
+    except Exception as e: r, err = None, e
+    while True:
+        msg = conn.recv()
+        if msg[0]=="close":
+            conn.close(); return
+        try:
+            if err is not None: raise err
+            if msg[0]=="stats":
+                df = {t:len(r.index[tid][0]) for t,tid in r.vocab.items() if r.index[tid][0]}
+                out = (r.n_live, sum(dl for d,dl in zip(r.docs, r.lens) if d is not None), df)
+            elif msg[0]=="corpus":
+                r.set_corpus(*msg[1:]); out = True
+            else:
+                t = time.perf_counter(); hits = r._search(*msg[1:]); out = (hits, time.perf_counter()-t)
+        except Exception as e:
+            try: conn.send(("error", e))
+            except Exception: conn.send(("error", RuntimeError(repr(e))))  # the exception does not pickle
+        else:
+            conn.send(("ok", out))
+
+class ShardedRetriever:
+    # Scatter-gather over shard processes. Files are dealt round-robin to `shards` workers, or `shards`
+    # lists the file names of each one (e.g. one KB per bank plus the regulatory KB). BM25 shards score
+    # against corpus-wide N/avgdl/df, and hits merge on the single-index key (score, file order, chunk#),
+    # so results equal one Retriever over the whole directory. `opts` go to every shard's Retriever, except
+    # those that cannot hold per shard: a query cache (not picklable; cache in front of this class instead),
+    # dedup (near-duplicates in different shards would never meet) and a storage backend. A cache_path gets
+    # one file per shard, "<stem>.shard<i><suffix>".
+    def __init__(self, kb_dir, shards=2, **opts):
+        bad = [o for o in ("query_cache", "dedup", "backend") if opts.get(o) is not None]
+        if bad: raise ValueError(f"not supported by ShardedRetriever: {', '.join(bad)}")
+        names = [fp.name for fp in _kb_files(kb_dir)]
+        groups = [names[i::shards] for i in range(shards)] if isinstance(shards, int) else [list(g) for g in shards]
+        cache = opts.pop("cache_path", None)
+        self.scorer = opts.get("scorer", "cosine")
+        self._rank = {n.rsplit(".",1)[0]:i for i,n in enumerate(names)}
+        ctx = mp.get_context("spawn")
+        self._conns = []; self._procs = []
+        for i,g in enumerate(groups):
+            parent, child = ctx.Pipe()
+            o = opts if cache is None else {**opts, "cache_path": Path(cache).with_suffix(f".shard{i}{Path(cache).suffix}")}
+            p = ctx.Process(target=_serve, args=(child, kb_dir, g, o), daemon=True); p.start()
+            self._conns.append(parent); self._procs.append(p)
+        self.latency = [deque(maxlen=1000) for _ in groups]
+        # one scatter-gather at a time: concurrent callers would otherwise read each other's replies
+        self._lock = threading.Lock()
+        self._df = Counter(); n = total = 0
+        try:
+            for sn, sl, df in self._gather(("stats",)):
+                n += sn; total += sl; self._df.update(df)
+            self.n_live = n
+            self._gather(("corpus", n, total/n if n else 0.0))
+        except BaseException:
+            self.close(); raise
+    def close(self):
+        with self._lock:
+            for c in self._conns: c.send(("close",))
+            for p in self._procs: p.join()
+            self._conns, self._procs = [], []
+    def _gather(self, msg):
+        # every shard replies before any error is raised, so the pipes stay in step for the next request
+        with self._lock:
+            if not self._conns: raise ValueError("ShardedRetriever is closed")
+            for c in self._conns: c.send(msg)
+            replies = [c.recv() for c in self._conns]
+        for status, out in replies:
+            if status=="error": raise out
+        return [out for _,out in replies]
+    def _key(self, h):
+        stem, i = h["id"].rsplit("#", 1)
+        return (-h["score"], self._rank[stem], int(i))
+    def search(self, query, k=4, where=None, snippet_chars=None, snippet_tokens=None, proximity=0.0):
+        df = {t:self._df[t] for t in set(_tokenize(query))} if self.scorer=="bm25" else None
+        parts = []
+        for lat,(hits, dt) in zip(self.latency, self._gather(("search", query, k, df, where, snippet_chars,
+                                                              snippet_tokens, proximity))):
+            # each shard's hits already come in this key's order: its chunks keep the global file order
+            lat.append(dt); parts.append(hits)
+        return list(islice(heapq.merge(*parts, key=self._key), k))
+    def latency_report(self):
+        # per-shard in-worker search time over the recent window, in ms
+        out = []
+        for i,lat in enumerate(self.latency):
+            xs = sorted(lat)
+            out.append({"shard": i, "queries": len(xs),
+                        "p50_ms": round(statistics.median(xs)*1e3, 3) if xs else None,
+                        "p95_ms": round(xs[int(0.95*(len(xs)-1))]*1e3, 3) if xs else None,
+                        "max_ms": round(xs[-1]*1e3, 3) if xs else None})
+        return out
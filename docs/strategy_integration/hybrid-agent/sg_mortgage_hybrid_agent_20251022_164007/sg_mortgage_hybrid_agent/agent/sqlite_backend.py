@@ -0,0 +1,97 @@
+import argparse, json, sqlite3, threading
+from pathlib import Path
+from agent.docstore import META_FIELDS, Hit
+from agent.retrieval import Retriever, iter_chunks, _PHRASE_RE, _tokenize
+
+# SQLite FTS5 storage backend: chunks live in a plain table (metadata + text) with an external-content FTS5
+# index over the text, so the KB persists in one file and a restart only re-stats the source files.
+# The FTS tokenizer keeps '.' and '%' inside tokens to split text the way _tokenize does.
+SCHEMA_VERSION = 1
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files(name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT);
+CREATE TABLE IF NOT EXISTS chunks(rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, source TEXT, section TEXT,
+                                  date TEXT, bank TEXT, text TEXT);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='rowid',
+                                                         tokenize="unicode61 tokenchars '.%'");
+"""
+
+class SQLiteBackend:
+    scorers = ("bm25",)  # ranks with FTS5's bm25() (k1=1.2, b=0.75, FTS5's own idf)
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # one connection shared by every thread the Retriever is called from, one statement at a time
+        self.path = path; self._conn = sqlite3.connect(path, check_same_thread=False); self._lock = threading.RLock()
+        self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+    def close(self):
+        with self._lock: self._conn.close()
+    def files(self):
+        with self._lock:
+            return {n:(size, mtime, sha) for n,size,mtime,sha in self._conn.execute("SELECT * FROM files")}
+    def sync(self, kb_dir, files, chunking):
+        # bring the store in line with the `files` fingerprint in one transaction: a failed update leaves
+        # the previous KB in place. Returns the names of the files that changed
+        db = self._conn
+        with self._lock, db:
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+            want = {"version": str(SCHEMA_VERSION), "chunking": json.dumps(list(chunking))}
+            if meta!=want:
+                db.execute("INSERT INTO chunks_fts(chunks_fts) VALUES('delete-all')")
+                db.execute("DELETE FROM chunks"); db.execute("DELETE FROM files"); db.execute("DELETE FROM meta")
+                db.executemany("INSERT INTO meta VALUES (?, ?)", want.items())
+            stored = self.files()
+            changed = sorted(n for n in stored.keys()|files.keys() if stored.get(n)!=files.get(n))
+            for n in changed:
+                # external-content FTS rows are removed by replaying the old values as a 'delete'
+                db.execute("INSERT INTO chunks_fts(chunks_fts, rowid, text) "
+                           "SELECT 'delete', rowid, text FROM chunks WHERE source=?", (n,))
+                db.execute("DELETE FROM chunks WHERE source=?", (n,)); db.execute("DELETE FROM files WHERE name=?", (n,))
+            start = db.execute("SELECT coalesce(max(rowid), 0) FROM chunks").fetchone()[0]
+            db.executemany("INSERT INTO chunks(id, source, section, date, bank, text) VALUES (?, ?, ?, ?, ?, ?)",
+                           ((d["id"], *(d[f] for f in META_FIELDS), d["text"])
+                            for n in changed if n in files for d in iter_chunks(Path(kb_dir)/n, *chunking)))
+            # one bulk FTS insert for everything added, rather than a trigger per row
+            db.execute("INSERT INTO chunks_fts(rowid, text) SELECT rowid, text FROM chunks WHERE rowid>?", (start,))
+            db.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", ((n, *files[n]) for n in changed if n in files))
+        return changed
+    def _where(self, where):
+        # same semantics as Retriever._mask: fields AND, listed values OR, a callable picks values
+        sql = []; args = []
+        for f,want in where.items():
+            if f not in META_FIELDS: raise ValueError(f"unknown metadata field: {f}")
+            if callable(want): vals = [v for (v,) in self._conn.execute(f"SELECT DISTINCT {f} FROM chunks") if want(v)]
+            elif isinstance(want, (list,tuple,set,frozenset)): vals = list(want)
+            else: vals = [want]
+            known = [v for v in vals if v is not None]
+            part = [f"c.{f} IN ({','.join('?'*len(known))})"] if known else []
+            if len(known)<len(vals): part.append(f"c.{f} IS NULL")
+            sql.append("(" + (" OR ".join(part) or "0") + ")"); args += known
+        return sql, args
+    def search(self, query, k, where=None):
+        tokens = dict.fromkeys(_tokenize(query))
+        if not tokens or k<=0: return []
+        match = " OR ".join(f'"{t}"' for t in tokens)
+        # quoted phrases map onto FTS5 phrase queries, which it answers from its own position lists
+        phrases = [" ".join(p) for p in map(_tokenize, _PHRASE_RE.findall(query)) if p]
+        if phrases: match = " AND ".join([f"({match})"]+[f'"{p}"' for p in phrases])
+        sql = ["chunks_fts MATCH ?"]; args = [match]
+        with self._lock:
+            if where:
+                more, extra = self._where(where); sql += more; args += extra
+            rows = self._conn.execute(
+                "SELECT c.id, c.text, c.source, c.section, c.date, c.bank, -bm25(chunks_fts) "
+                "FROM chunks_fts JOIN chunks c ON c.rowid = chunks_fts.rowid "
+                f"WHERE {' AND '.join(sql)} ORDER BY bm25(chunks_fts), c.rowid LIMIT ?", (*args, k)).fetchall()
+        # read-only hits, as from the in-memory index: the query cache hands the same objects to every caller
+        return [ Hit({"id":i, "text":text, "source":src, "section":sec, "date":date, "bank":bank, "aliases":()}, s)
+                 for i,text,src,sec,date,bank,s in rows ]
+
+if __name__=="__main__":
+    # python -m agent.sqlite_backend data/kb data/.cache/kb.sqlite "break fee"
+    ap = argparse.ArgumentParser()
+    ap.add_argument("kb_dir"); ap.add_argument("db"); ap.add_argument("query"); ap.add_argument("-k", type=int, default=4)
+    args = ap.parse_args()
+    r = Retriever(args.kb_dir, scorer="bm25", backend=SQLiteBackend(args.db))
+    print(json.dumps([dict(h) for h in r.search(args.query, args.k)], indent=2))
@@ -0,0 +1,54 @@
+import argparse, json, random, tempfile, time
+from pathlib import Path
+import numpy as np
+from agent.dedup import minhash
+from agent.retrieval import Retriever, _tokenize
+from bench.synth import write_kb, queries, _topics
+
+def write_boilerplate(out_dir, chunks, copies, edits=3, seed=0):
+    # rate-sheet style exports: each file repeats its bank's boilerplate paragraphs `copies` times, with
+    # a few words changed per copy (dates, rates), so chunks are near- but not exact duplicates
+    rng = random.Random(seed+7); out = Path(out_dir)
+    for f,topic in enumerate(_topics(max(1, chunks//200), seed)):
+        paras = []
+        for _ in range(5):
+            words = []; size = 0
+            while size<=1200:
+                w = topic.word(rng); words.append(w); size += len(w)+1
+            paras.append(words)
+        with open(out/f"{topic.bank.lower()}_{f:05d}_export.md", "w", encoding="utf-8") as fh:
+            for _ in range(copies):
+                for words in paras:
+                    w = list(words)
+                    for _ in range(edits): w[rng.randrange(len(w))] = f"{rng.uniform(0.5, 4.5):.2f}%"
+                    fh.write(" ".join(w)+"\n")
+
+def _redundancy(r, qs, threshold, k):
+    # share of top-k result pairs that are near-duplicates of each other
+    pairs = dup = 0
+    for q in qs:
+        sigs = [np.frombuffer(minhash(_tokenize(h["text"])), np.uint32) for h in r.search(q, k)]
+        for a in range(len(sigs)):
+            for b in range(a+1, len(sigs)):
+                pairs += 1; dup += (sigs[a]==sigs[b]).mean()>=threshold
+    return round(dup/(pairs or 1), 4)
+
+def run(chunks, copies, threshold, k=4, seed=0):
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed); write_boilerplate(d, chunks, copies, seed=seed)
+        qs = queries(200, chunks, seed=seed)
+        t = time.perf_counter(); plain = Retriever(d, scorer="bm25"); t_plain = time.perf_counter()-t
+        t = time.perf_counter(); dd = Retriever(d, scorer="bm25", dedup=threshold); t_dedup = time.perf_counter()-t
+        report = dd.dedup_report()
+        report.update({"build_s": round(t_plain, 2), "build_dedup_s": round(t_dedup, 2),
+                       "top%d_dup_pairs" % k: _redundancy(plain, qs, threshold, k),
+                       "top%d_dup_pairs_dedup" % k: _redundancy(dd, qs, threshold, k)})
+    return report
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[5_000])
+    ap.add_argument("--copies", type=int, default=4)
+    ap.add_argument("--threshold", type=float, default=0.8)
+    args = ap.parse_args()
+    print(json.dumps([run(n, args.copies, args.threshold) for n in args.chunks], indent=2))
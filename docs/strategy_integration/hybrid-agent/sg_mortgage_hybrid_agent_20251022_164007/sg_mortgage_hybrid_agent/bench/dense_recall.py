@@ -0,0 +1,33 @@
+import argparse, json, statistics, tempfile, time
+from agent.dense import DenseRetriever
+from bench.synth import write_kb, queries
+
+def run(chunks, n_queries=200, k=4, probes=(32,), seed=0):
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed)
+        t = time.perf_counter(); r = DenseRetriever(d, seed=seed); build = time.perf_counter()-t
+    qs = queries(n_queries, chunks, seed=seed); exact_lat = []; refs = []
+    for q in qs:
+        t = time.perf_counter(); refs.append({h["id"] for h in r.search_exact(q, k)}); exact_lat.append(time.perf_counter()-t)
+    ms = lambda xs, p: round(statistics.quantiles(xs, n=100)[p-1]*1e3, 3)
+    rows = []
+    for probe in probes:
+        # probe is read at query time: one index serves every setting
+        r.probe = probe; lat = []; recall = []
+        for q,ref in zip(qs, refs):
+            t = time.perf_counter(); got = r.search(q, k); lat.append(time.perf_counter()-t)
+            recall.append(len({h["id"] for h in got} & ref) / max(1, len(ref)))
+        rows.append({"chunks": len(r.docs), "k": k, "lists": len(r.centroids), "probe": probe,
+                     "build_s": round(build, 2), f"recall@{k}": round(statistics.mean(recall), 3),
+                     "ivf_p50_ms": ms(lat, 50), "ivf_p95_ms": ms(lat, 95),
+                     "exact_p50_ms": ms(exact_lat, 50), "exact_p95_ms": ms(exact_lat, 95)})
+    return rows
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--probe", type=int, nargs="+", default=[8, 16, 32, 64])
+    args = ap.parse_args()
+    print(json.dumps([row for n in args.chunks for row in run(n, args.queries, args.k, args.probe)], indent=2))
@@ -0,0 +1,37 @@
+import argparse, json, tempfile, tracemalloc
+from agent.retrieval import Retriever, load_kb
+from bench.synth import write_kb, queries
+
+def _traced(fn):
+    tracemalloc.start(); obj = fn(); size = tracemalloc.get_traced_memory()[0]; tracemalloc.stop()
+    return obj, size
+
+def _per_query(fn, qs):
+    # bytes the returned hits hold on to, per query, with every query's hits kept alive as a caller
+    # collecting contexts would (scoring scratch space is freed by then and not counted)
+    tracemalloc.start(); keep = [fn(q) for q in qs]; size = tracemalloc.get_traced_memory()[0]; tracemalloc.stop()
+    return size/len(keep)
+
+def run(chunks, n_queries, k, seed=0):
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed)
+        docs, dicts = _traced(lambda: load_kb(d))
+        r = Retriever(d, scorer="bm25")
+        _, store = _traced(lambda: Retriever(d, scorer="bm25").docs)
+        qs = queries(n_queries, chunks, seed=seed)
+        # the previous hit format: a copy of the chunk's dict plus the score (load_kb yields chunks in index order)
+        copies = lambda q: [ {**docs[h.chunk._i], "score":h.score} for h in r._search(q, k) ]
+        views = lambda q: r._search(q, k)
+        out = {"chunks": len(r.docs), "k": k,
+               "dict_docs_mb": round(dicts/2**20, 2), "doc_store_mb": round(store/2**20, 2),
+               "dict_hits_bytes_per_query": round(_per_query(copies, qs)),
+               "view_hits_bytes_per_query": round(_per_query(views, qs))}
+    return out
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[10_000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+    print(json.dumps([run(n, args.queries, args.k) for n in args.chunks], indent=2))
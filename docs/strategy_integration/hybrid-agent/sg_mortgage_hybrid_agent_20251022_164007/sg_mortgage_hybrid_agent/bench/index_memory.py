@@ -0,0 +1,33 @@
+import argparse, json, tempfile, tracemalloc
+from agent.retrieval import Retriever
+from bench.synth import write_kb
+
+def _traced(fn):
+    tracemalloc.start(); obj = fn(); size = tracemalloc.get_traced_memory()[0]; tracemalloc.stop()
+    return obj, size
+
+def _as_arrays(r):
+    return [(a[:], b[:]) for a,b in r.vecs], [(a[:], b[:]) for a,b in r.index], dict(r.vocab)
+
+def _as_dicts(r):
+    # the pre-interning layout: {token: weight} per chunk plus token -> [(chunk, weight)] postings
+    inv = {tid:t for t,tid in r.vocab.items()}
+    vecs = [{inv[t]:w for t,w in zip(ids, ws)} for ids,ws in r.vecs]
+    index = {inv[tid]:list(zip(*p)) for tid,p in enumerate(r.index) if p[0]}
+    return vecs, index
+
+def run(chunks, seed=0):
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed)
+        r = Retriever(d)
+        _, arrays = _traced(lambda: _as_arrays(r))
+        _, dicts = _traced(lambda: _as_dicts(r))
+    return {"chunks": len(r.docs), "vocab": len(r.vocab), "nnz": sum(len(v[0]) for v in r.vecs),
+            "dict_layout_mb": round(dicts/2**20, 2), "array_layout_mb": round(arrays/2**20, 2),
+            "saving": round(1-arrays/dicts, 3)}
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[10_000])
+    args = ap.parse_args()
+    print(json.dumps([run(n) for n in args.chunks], indent=2))
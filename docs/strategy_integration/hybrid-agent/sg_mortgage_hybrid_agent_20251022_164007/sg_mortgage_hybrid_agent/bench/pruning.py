@@ -0,0 +1,34 @@
+import argparse, json, statistics, tempfile, time
+from agent.retrieval import Retriever
+from bench.synth import write_kb, queries
+
+def _timed(r, qs, k):
+    out = []; lat = []
+    for q in qs:
+        t = time.perf_counter(); out.append(r.search(q, k)); lat.append(time.perf_counter()-t)
+    return out, lat
+
+def run(chunks, n_queries, words, k, seed=0):
+    res = []
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed)
+        qs = queries(n_queries, chunks, seed=seed, words=words)
+        for scorer in ("bm25", "cosine"):
+            full, t_full = _timed(Retriever(d, scorer=scorer, prune=False), qs, k)
+            pruned, t_pruned = _timed(Retriever(d, scorer=scorer, prune=True), qs, k)
+            res.append({"scorer": scorer, "chunks": chunks, "query_words": list(words), "k": k,
+                        "identical": full==pruned,
+                        "exhaustive_p50_ms": round(statistics.median(t_full)*1e3, 3),
+                        "pruned_p50_ms": round(statistics.median(t_pruned)*1e3, 3),
+                        "speedup": round(sum(t_full)/sum(t_pruned), 2)})
+    return res
+
+if __name__=="__main__":
+    # long chat-style queries: most words are common tokens whose postings cover much of the KB
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[5_000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--words", type=int, nargs=2, default=[20, 40])
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+    print(json.dumps([r for n in args.chunks for r in run(n, args.queries, tuple(args.words), args.k)], indent=2))
@@ -0,0 +1,47 @@
+import argparse, json, statistics, tempfile, time
+from array import array
+from agent.retrieval import Retriever, PRECISIONS
+from bench.synth import write_kb, queries
+
+def _weight_bytes(r):
+    raw = lambda ws: ws if isinstance(ws, array) else ws.raw
+    n = sum(len(raw(ws))*raw(ws).itemsize for _,ws in r.index) + sum(len(raw(ws))*raw(ws).itemsize for _,ws in r.vecs)
+    return n + (len(r.scale)*r.scale.itemsize if r.scale is not None else 0)
+
+def _ranking(ref, got, k):
+    # top-k agreement with the float64 index: set overlap, identical order, same top-1, score drift
+    overlap = same = top1 = 0; drift = []
+    for a,b in zip(ref, got):
+        ia = [h["id"] for h in a]; ib = [h["id"] for h in b]
+        overlap += len(set(ia)&set(ib))/max(len(ia), 1); same += ia==ib; top1 += ia[:1]==ib[:1]
+        sb = {h["id"]:h["score"] for h in b}
+        drift += [abs(sb[h["id"]]-h["score"])/(abs(h["score"]) or 1) for h in a if h["id"] in sb]
+    n = len(ref)
+    return {"overlap_at_k": round(overlap/n, 4), "same_order": round(same/n, 4), "same_top1": round(top1/n, 4),
+            "max_rel_score_err": round(max(drift, default=0.0), 5)}
+
+def run(chunks, n_queries, k, seed=0):
+    res = []
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed); qs = queries(n_queries, chunks, seed=seed)
+        for scorer in ("cosine", "bm25"):
+            ref = None
+            for precision in PRECISIONS:
+                r = Retriever(d, scorer=scorer, precision=precision)
+                lat = []; hits = []
+                for q in qs:
+                    t = time.perf_counter(); hits.append(r.search(q, k)); lat.append(time.perf_counter()-t)
+                row = {"scorer": scorer, "precision": precision, "chunks": len(r.docs), "k": k,
+                       "weight_mb": round(_weight_bytes(r)/2**20, 2), "p50_ms": round(statistics.median(lat)*1e3, 3)}
+                if ref is None: ref = hits
+                else: row.update(_ranking(ref, hits, k))
+                res.append(row)
+    return res
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[5_000])
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+    print(json.dumps([r for n in args.chunks for r in run(n, args.queries, args.k)], indent=2))
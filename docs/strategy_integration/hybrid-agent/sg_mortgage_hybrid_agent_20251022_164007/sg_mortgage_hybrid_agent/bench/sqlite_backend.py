@@ -0,0 +1,41 @@
+import argparse, json, statistics, tempfile, time
+from pathlib import Path
+from agent.retrieval import Retriever
+from agent.sqlite_backend import SQLiteBackend
+from bench.synth import write_kb, queries
+
+def _timed(fn):
+    t = time.perf_counter(); out = fn(); return out, round(time.perf_counter()-t, 3)
+
+def _p50(r, qs, k):
+    lat = []
+    for q in qs:
+        t = time.perf_counter(); r.search(q, k); lat.append(time.perf_counter()-t)
+    return round(statistics.median(lat)*1e3, 3)
+
+def run(chunks, n_queries, k, seed=0):
+    with tempfile.TemporaryDirectory() as d:
+        kb = Path(d)/"kb"; write_kb(kb, chunks, seed=seed); qs = queries(n_queries, chunks, seed=seed)
+        pkl, db = str(Path(d)/"kb.pkl"), str(Path(d)/"kb.sqlite")
+        mem, mem_build = _timed(lambda: Retriever(kb, scorer="bm25", cache_path=pkl))
+        _, mem_cold = _timed(lambda: Retriever(kb, scorer="bm25", cache_path=pkl))
+        sql, sql_build = _timed(lambda: Retriever(kb, scorer="bm25", backend=SQLiteBackend(db)))
+        _, sql_cold = _timed(lambda: Retriever(kb, scorer="bm25", backend=SQLiteBackend(db)))
+        # an incremental update: one file rewritten, applied in a single transaction
+        first = sorted(kb.glob("*.md"))[0]; first.write_text(first.read_text(encoding="utf-8")+"\nrefreshed\n", encoding="utf-8")
+        _, sql_refresh = _timed(sql.refresh)
+        size = sum(p.stat().st_size for p in Path(d).glob("kb.sqlite*"))  # db + WAL
+        overlap = sum(len({h["id"] for h in mem.search(q, k)} & {h["id"] for h in sql.search(q, k)}) for q in qs)
+        return {"chunks": len(mem.docs), "k": k,
+                "memory_build_s": mem_build, "memory_cold_start_s": mem_cold, "memory_p50_ms": _p50(mem, qs, k),
+                "sqlite_build_s": sql_build, "sqlite_cold_start_s": sql_cold, "sqlite_p50_ms": _p50(sql, qs, k),
+                "sqlite_refresh_one_file_s": sql_refresh, "sqlite_mb": round(size/2**20, 2),
+                "overlap_at_k": round(overlap/(k*len(qs)), 4)}
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[10_000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+    print(json.dumps([run(n, args.queries, args.k) for n in args.chunks], indent=2))
@@ -0,0 +1,134 @@
+import argparse, json, multiprocessing as mp, platform, resource, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from agent.retrieval import INDEX_VERSION, Retriever, load_kb
+from bench.synth import write_kb, queries
+
+# End-to-end retrieval benchmark over synthetic mortgage KBs: per KB size and retriever variant, chunking
+# (load_kb) and index build time, peak RSS, search latency percentiles and throughput, as JSON. Each
+# (size, variant) runs in a fresh process so peak RSS is that variant's own; "kind" picks the retriever
+# class (default: Retriever), the other keys are its options. A packed variant's file is written in a
+# process of its own first (build_s includes it), and a sharded variant also reports its largest shard
+# process's peak RSS. Compare two runs with
+#   python -m bench.suite --out new.json --baseline old.json
+VARIANTS = {
+    "cosine": {"scorer": "cosine"},
+    "bm25": {"scorer": "bm25"},
+    "bm25-exhaustive": {"scorer": "bm25", "prune": False},
+    "bm25-int8": {"scorer": "bm25", "precision": "int8"},
+    "bm25-positions": {"scorer": "bm25", "positions": True},
+    "bm25-sqlite": {"scorer": "bm25", "backend": "sqlite"},
+    "dense": {"kind": "dense"},
+    "hybrid-bm25": {"kind": "hybrid", "scorer": "bm25"},
+    "packed-bm25": {"kind": "packed", "scorer": "bm25"},
+    "sharded-bm25": {"kind": "sharded", "scorer": "bm25", "shards": 2},
+}
+_COMPARE = ("load_kb_s", "build_s", "peak_rss_mb", "p50_ms", "p95_ms", "p99_ms", "qps")
+
+def _rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss/1024  # KiB on Linux
+
+def _pct(xs, p):
+    return xs[min(len(xs)-1, int(p*len(xs)))]
+
+def _load(kb):
+    # runs in its own process: load_kb keeps every chunk dict, which would otherwise swamp a variant's RSS
+    base = _rss_mb(); t = time.perf_counter(); n = len(load_kb(kb))
+    return {"chunks": n, "load_kb_s": round(time.perf_counter()-t, 3), "load_kb_rss_mb": round(_rss_mb()-base, 1)}
+
+def _pack(kb, path, opts):
+    # runs in its own process, so the in-memory Retriever it packs does not count against the packed variant
+    from agent.packed import write_packed
+    t = time.perf_counter(); write_packed(Retriever(kb, **opts), path)
+    return time.perf_counter()-t
+
+def _open(kb, opts, tmp, pack):
+    # (retriever, close) for a variant's options
+    kind = opts.pop("kind", "retriever")
+    if kind=="dense":
+        from agent.dense import DenseRetriever
+        return DenseRetriever(kb, **opts), None
+    if kind=="hybrid":
+        from agent.dense import DenseRetriever
+        from agent.hybrid import HybridRetriever
+        h = HybridRetriever(Retriever(kb, **opts), DenseRetriever(kb))
+        return h, h.close
+    if kind=="packed":
+        from agent.packed import PackedRetriever
+        p = PackedRetriever(pack)
+        return p, p.close
+    if kind=="sharded":
+        from agent.shards import ShardedRetriever
+        s = ShardedRetriever(kb, **opts)
+        return s, s.close
+    if opts.get("backend")=="sqlite":
+        from agent.sqlite_backend import SQLiteBackend
+        opts["backend"] = SQLiteBackend(Path(tmp)/"kb.sqlite")
+    r = Retriever(kb, **opts)
+    return r, r.backend.close if r.backend is not None else None
+
+def _measure(kb, variant, qs, k, warmup, pack=None, pack_s=0.0):
+    # runs in its own process
+    opts = dict(VARIANTS[variant]); base = _rss_mb()
+    with tempfile.TemporaryDirectory() as tmp:
+        t = time.perf_counter(); r, close = _open(kb, opts, tmp, pack); build = pack_s+time.perf_counter()-t
+        for q in qs[:warmup]: r.search(q, k)
+        lat = []; t0 = time.perf_counter()
+        for q in qs[warmup:]:
+            t = time.perf_counter(); r.search(q, k); lat.append(time.perf_counter()-t)
+        total = time.perf_counter()-t0
+        if close: close()
+    lat.sort()
+    row = {"variant": variant, "k": k, "queries": len(lat), "build_s": round(build, 3),
+           "base_rss_mb": round(base, 1), "peak_rss_mb": round(_rss_mb(), 1),
+           "p50_ms": round(_pct(lat, 0.50)*1e3, 3), "p95_ms": round(_pct(lat, 0.95)*1e3, 3),
+           "p99_ms": round(_pct(lat, 0.99)*1e3, 3), "qps": round(len(lat)/total, 1)}
+    # shard processes have exited (close() joins them), so this is the largest one's peak
+    if VARIANTS[variant].get("kind")=="sharded": row["shard_peak_rss_mb"] = round(_rss_mb(resource.RUSAGE_CHILDREN), 1)
+    return row
+
+def _compare(rows, baseline):
+    # new/old ratio per metric for the rows both runs have; > 1 is slower/larger, except for qps
+    old = {(r["chunks"], r["variant"]):r for r in baseline["results"]}
+    for r in rows:
+        b = old.get((r["chunks"], r["variant"]))
+        if b: r["vs_baseline"] = {m:round(r[m]/b[m], 3) for m in _COMPARE if b.get(m)}
+    return rows
+
+def run(sizes, variants, n_queries, k, warmup=20, work_dir=None, seed=0):
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown: raise ValueError(f"unknown variants: {unknown}")
+    rows = []; ctx = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            # a KB under --work-dir is written once and reused: a million chunks take minutes to generate
+            kb = Path(work_dir or tmp)/f"kb_{n}_{seed}"
+            if not kb.exists(): write_kb(kb, n, seed=seed)
+            qs = queries(n_queries+warmup, n, seed=seed)
+            with ProcessPoolExecutor(1, mp_context=ctx) as ex: load = ex.submit(_load, str(kb)).result()
+            for v in variants:
+                pack = pack_s = None
+                if VARIANTS[v].get("kind")=="packed":
+                    opts = {o:x for o,x in VARIANTS[v].items() if o!="kind"}; pack = str(Path(tmp)/f"kb_{n}_{seed}.pack")
+                    with ProcessPoolExecutor(1, mp_context=ctx) as ex: pack_s = ex.submit(_pack, str(kb), pack, opts).result()
+                with ProcessPoolExecutor(1, mp_context=ctx) as ex:
+                    rows.append({**load, **ex.submit(_measure, str(kb), v, qs, k, warmup, pack, pack_s or 0.0).result()})
+                print(json.dumps(rows[-1]), file=sys.stderr)
+    return rows
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    ap.add_argument("--variants", nargs="+", default=list(VARIANTS))
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--work-dir", help="keep generated KBs here between runs")
+    ap.add_argument("--out", help="write the JSON report here as well as to stdout")
+    ap.add_argument("--baseline", help="earlier report to compare against")
+    args = ap.parse_args()
+    rows = run(args.sizes, args.variants, args.queries, args.k, work_dir=args.work_dir)
+    if args.baseline: rows = _compare(rows, json.loads(Path(args.baseline).read_text()))
+    report = {"index_version": INDEX_VERSION, "python": platform.python_version(), "machine": platform.machine(),
+              "results": rows}
+    out = json.dumps(report, indent=2); print(out)
+    if args.out: Path(args.out).write_text(out)
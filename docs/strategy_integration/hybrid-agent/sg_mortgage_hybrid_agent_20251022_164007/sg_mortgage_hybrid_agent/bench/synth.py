@@ -0,0 +1,70 @@
+import random
+from pathlib import Path
+
+BANKS = ["DBS","OCBC","UOB","Maybank","HSBC","SCB","Citibank","CIMB","RHB","BOC","HLF","SBI"]
+TERMS = ["SORA","3M","compounded","TDSR","MSR","LTV","lock-in","break","fee","clawback","legal","subsidy",
+         "valuation","refinance","reprice","fixed","floating","package","spread","board","rate","tenure",
+         "HDB","EC","private","condo","loan","quantum","outstanding","redemption","disbursement","LO",
+         "penalty","partial","prepayment","cash","CPF","OA","income","guarantor","cancellation","conversion"]
+PHRASES = ["lock-in period","break fee","legal subsidy clawback","cancellation fee","valuation subsidy",
+           "fire insurance","partial prepayment","3M compounded SORA","board rate","fixed deposit pegged",
+           "loan-to-value limit","total debt servicing ratio","mortgage servicing ratio","letter of offer",
+           "option to purchase","conversion fee","repricing window","free conversion","CPF OA refund",
+           "variable income haircut","interest rate floor","stress test rate"]
+SECTIONS = ["Eligibility","Rates and packages","Fees and charges","Lock-in and repricing","Refinancing",
+            "Regulatory limits","Prepayment","Subsidies and clawbacks","Worked examples","FAQ"]
+FILLER = ["the","a","of","to","and","in","for","on","is","are","with","by","be","if","within","after",
+          "during","per","each","any","which","may","must","shall","will","not","than","or"]
+
+class _Topic:
+    # one KB file: a bank, a handful of focus terms and its own clause/product codes, so chunks of the
+    # same file resemble each other the way a real rate sheet or circular does
+    def __init__(self, rng, idx):
+        self.bank = rng.choice(BANKS)
+        self.terms = rng.sample(TERMS, 6)
+        self.phrases = rng.sample(PHRASES, 4)
+        self.codes = [f"{rng.choice(self.terms).lower()}{idx}x{j}" for j in range(40)]
+    def word(self, rng):
+        r = rng.random()
+        if r<0.40: return rng.choice(FILLER)
+        if r<0.62: return rng.choice(self.terms)
+        if r<0.70: return rng.choice(TERMS)
+        if r<0.75: return rng.choice(self.phrases)
+        if r<0.82: return self.bank
+        if r<0.88: return f"{rng.uniform(0.5, 4.5):.2f}%"
+        return rng.choice(self.codes)
+
+def _topics(n_files, seed):
+    rng = random.Random(seed)
+    return [_Topic(rng, f) for f in range(n_files)]
+
+def write_kb(out_dir, chunks, chunks_per_file=200, chunk_chars=1200, seed=0, section_every=25):
+    # writes ~`chunks` chunks worth of markdown (at the default 1200-char chunking) across bank files, with
+    # a dated "## section" heading every `section_every` chunks so section/date filters have something to
+    # select. Files are streamed out, so a million chunks (~1.2 GB) never sit in memory
+    rng = random.Random(seed); out = Path(out_dir); out.mkdir(parents=True, exist_ok=True)
+    n_files = max(1, -(-chunks//chunks_per_file)); files = []
+    for f,topic in enumerate(_topics(n_files, seed)):
+        fp = out/f"{topic.bank.lower()}_{f:05d}.md"
+        n = min(chunks_per_file, chunks - f*chunks_per_file)
+        with open(fp, "w", encoding="utf-8") as fh:
+            fh.write(f"# {topic.bank} {' '.join(topic.terms[:2])} (synthetic)\n")
+            for j in range(n):
+                if section_every and j%section_every==0:
+                    fh.write(f"## {rng.choice(SECTIONS)} (effective {rng.randint(2019, 2025)}-"
+                             f"{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d})\n")
+                size = 0; line = []
+                while size<=chunk_chars:
+                    w = topic.word(rng); line.append(w); size += len(w)+1
+                fh.write(" ".join(line)+"\n")
+        files.append(fp)
+    return files
+
+def queries(n, chunks, chunks_per_file=200, seed=0, qseed=1, words=(2, 12)):
+    # chat-style queries about the topics of a KB written by write_kb(..., chunks, chunks_per_file, seed)
+    topics = _topics(max(1, -(-chunks//chunks_per_file)), seed); rng = random.Random(qseed)
+    out = []
+    for _ in range(n):
+        t = rng.choice(topics)
+        out.append(" ".join(t.word(rng) for _ in range(rng.randint(*words))))
+    return out
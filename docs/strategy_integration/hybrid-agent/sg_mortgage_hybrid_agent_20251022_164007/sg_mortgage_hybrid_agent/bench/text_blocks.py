@@ -0,0 +1,35 @@
+import argparse, json, statistics, tempfile, time
+from agent.docstore import TEXT_CACHE
+from agent.retrieval import Retriever
+from bench.synth import write_kb, queries
+
+def run(chunks, n_queries, k, blocks, caches, seed=0):
+    res = []
+    with tempfile.TemporaryDirectory() as d:
+        write_kb(d, chunks, seed=seed); qs = queries(n_queries, chunks, seed=seed)
+        for block in blocks:
+            t = time.perf_counter(); r = Retriever(d, scorer="bm25", text_block=block); build = time.perf_counter()-t
+            raw = sum(len(r.docs.text(i).encode()) for i,c in enumerate(r.docs) if c is not None)
+            r.docs._lru.clear()
+            for cache in caches if block else [0]:
+                # search plus reading the k hit texts, as the agent does to build its context
+                r.docs.cache = cache; r.docs._lru.clear(); lat = []
+                for q in qs:
+                    t = time.perf_counter(); [h["text"] for h in r.search(q, k)]; lat.append(time.perf_counter()-t)
+                lat.sort()
+                res.append({"chunks": len(r.docs), "k": k, "text_block": block, "text_cache": cache,
+                            "text_mb": round((r.docs.nbytes()-sum(map(len, r.docs._lru.values())))/2**20, 2),
+                            "raw_text_mb": round(raw/2**20, 2), "build_s": round(build, 3),
+                            "p50_ms": round(lat[len(lat)//2]*1e3, 3), "p95_ms": round(lat[int(0.95*(len(lat)-1))]*1e3, 3),
+                            "mean_ms": round(statistics.fmean(lat)*1e3, 3)})
+    return res
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", type=int, nargs="+", default=[10_000])
+    ap.add_argument("--queries", type=int, default=300)
+    ap.add_argument("--k", type=int, default=4)
+    ap.add_argument("--blocks", type=int, nargs="+", default=[0, 4096, 16384, 65536, 262144])
+    ap.add_argument("--caches", type=int, nargs="+", default=[0, TEXT_CACHE])
+    args = ap.parse_args()
+    print(json.dumps([r for n in args.chunks for r in run(n, args.queries, args.k, args.blocks, args.caches)], indent=2))
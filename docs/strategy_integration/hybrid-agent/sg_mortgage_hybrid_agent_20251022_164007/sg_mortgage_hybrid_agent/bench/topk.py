@@ -0,0 +1,29 @@
+import argparse, json, random, time
+from agent.retrieval import _topk
+
+def _full_sort(scored, k):
+    return sorted(scored, key=lambda x:(-x[1], x[0]))[:k]
+
+def _time(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(*args); best = min(best, time.perf_counter()-t)
+    return best
+
+def run(sizes, k, seed=0):
+    rng = random.Random(seed); rows = []
+    for n in sizes:
+        # quantized scores so the tie-break path is exercised as well
+        acc = {i: round(rng.random(), 4) for i in range(n)}
+        assert _topk(acc.items(), k) == _full_sort(acc.items(), k)
+        full, heap = _time(_full_sort, acc.items(), k), _time(_topk, acc.items(), k)
+        rows.append({"chunks": n, "k": k, "full_sort_ms": round(full*1e3, 3), "heap_ms": round(heap*1e3, 3),
+                     "speedup": round(full/heap, 2)})
+    return rows
+
+if __name__=="__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000])
+    ap.add_argument("--k", type=int, default=4)
+    args = ap.parse_args()
+    print(json.dumps(run(args.sizes, args.k), indent=2))